@@ -0,0 +1,290 @@
+"""
+Async read endpoints for serving the hottest GET paths under an ASGI server.
+
+Only safe methods are handled here: anything else is handed over to the
+regular DRF viewsets in a worker thread, so writes keep the sync code path.
+The anonymous feed, tag list and ingredient searches go through the same
+``cached`` entries as the sync views (``api/feed_cache.py``), filled in a
+worker thread since the cache client is sync.
+Enabled with ``ASYNC_READ_VIEWS=true`` (see ``api/urls.py``).
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django_filters.utils import translate_validation
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from foodgram_backend.cache import cached
+from foodgram_backend.compression import cache_compressed
+from recipes.models import Ingredient, Recipe, Tag
+from . import feed_cache
+from .conditional import not_modified, recipe_etag, set_validators
+from .filters import RecipeFilter, parse_id
+from .read_serializers import FieldSet, aserialize_recipes
+from .serializers import IngredientSerializer, TagSerializer
+from .views import (CustomPagination, IngredientViewSet, RecipeViewSet,
+                    cached_recipe)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+NOT_FOUND = {'detail': 'Страница не найдена.'}
+INVALID_PAGE = 'Неправильная страница'
+
+recipe_list_view = RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+recipe_detail_view = RecipeViewSet.as_view({
+    'get': 'retrieve',
+    'put': 'update',
+    'patch': 'partial_update',
+    'delete': 'destroy',
+})
+
+
+def async_read_view(sync_view=None):
+    """
+    Marks an async view csrf-exempt like DRF views are and, for unsafe
+    methods, delegates to ``sync_view`` instead of the async handler.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS and sync_view:
+                return await sync_to_async(sync_view)(
+                    request, *args, **kwargs)
+            request.user = await aauthenticate(request)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def aauthenticate(request):
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != b'token':
+        return AnonymousUser()
+    try:
+        token = await Token.objects.select_related('user').aget(
+            key=auth[1].decode())
+    except (Token.DoesNotExist, UnicodeError):
+        return AnonymousUser()
+    return token.user if token.user.is_active else AnonymousUser()
+
+
+def json_response(data, status=200):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    return HttpResponse(renderer.render(data), status=status,
+                        content_type=renderer.media_type)
+
+
+def page_size(request):
+    """Same as ``CustomPagination.get_page_size``."""
+    if request.GET.get('ids'):
+        return settings.RECIPE_IDS_MAX_COUNT
+    try:
+        limit = min(
+            int(request.GET.get(CustomPagination.page_size_query_param)),
+            CustomPagination.max_page_size)
+        if limit < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        limit = settings.REST_FRAMEWORK['PAGE_SIZE']
+    return limit
+
+
+def page_count(count, limit):
+    return max(1, -(-count // limit))
+
+
+def page_number(request, count, limit):
+    """The requested page of ``count`` objects, or None if there is none."""
+    page = request.GET.get('page', 1)
+    if page in CustomPagination.last_page_strings:
+        return page_count(count, limit)
+    try:
+        page = int(page)
+    except ValueError:
+        return None
+    return page if 1 <= page <= page_count(count, limit) else None
+
+
+def page_links(request, page, count, limit):
+    url = request.build_absolute_uri()
+    previous = None
+    if page > 1:
+        previous = (remove_query_param(url, 'page') if page == 2
+                    else replace_query_param(url, 'page', page - 1))
+    return {
+        'count': count,
+        'next': (replace_query_param(url, 'page', page + 1)
+                 if page < page_count(count, limit) else None),
+        'previous': previous,
+    }
+
+
+async def apaginate(request, queryset):
+    """Same page shape and query params as ``CustomPagination``."""
+    limit = page_size(request)
+    count = await queryset.acount()
+    page = page_number(request, count, limit)
+    if page is None:
+        return None, {'detail': INVALID_PAGE}
+    offset = (page - 1) * limit
+    objects = [obj async for obj in queryset[offset:offset + limit]]
+    return objects, page_links(request, page, count, limit)
+
+
+def filter_recipes(request):
+    filterset = RecipeFilter(
+        request.GET,
+        queryset=Recipe.objects.with_user_flags(request.user),
+        request=request,
+    )
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    return filterset.qs
+
+
+def cached_feed_page(request, limit):
+    """Ids of an anonymous feed page, shared with the sync view."""
+    def page_ids():
+        queryset = filter_recipes(request)
+        count = queryset.count()
+        page = page_number(request, count, limit)
+        if page is None:
+            raise NotFound(INVALID_PAGE)
+        offset = (page - 1) * limit
+        ids = queryset.values_list('id', flat=True)[offset:offset + limit]
+        return {'ids': list(ids), 'count': count, 'number': page}
+
+    return cached(feed_cache.feed_key(request, limit), page_ids,
+                  settings.FEED_CACHE_TIMEOUT, feed_cache.feed_stats)
+
+
+async def acached_feed_page(request, fieldset):
+    """``apaginate`` over the cached ids of an anonymous feed page."""
+    limit = page_size(request)
+    try:
+        entry = await sync_to_async(cached_feed_page)(request, limit)
+    except NotFound as error:
+        return None, {'detail': error.detail}
+    queryset = Recipe.objects.with_user_flags(request.user).filter(
+        id__in=entry['ids']).values(*fieldset.values())
+    rows = {row['id']: row async for row in queryset}
+    return ([rows[pk] for pk in entry['ids'] if pk in rows],
+            page_links(request, entry['number'], entry['count'], limit))
+
+
+@async_read_view(recipe_list_view)
+async def recipe_list(request):
+    return await aconditional(request, render_recipe_list)
+
+
+async def render_recipe_list(request):
+    fieldset = FieldSet.from_params(request.GET)
+    try:
+        if feed_cache.is_cacheable(request):
+            recipes, page = await acached_feed_page(request, fieldset)
+        else:
+            # Some filters (have=) read the database while building the
+            # queryset.
+            queryset = await sync_to_async(filter_recipes)(request)
+            recipes, page = await apaginate(
+                request, queryset.values(*fieldset.values()))
+    except ValidationError as error:
+        return json_response(error.detail, status=400)
+    if recipes is None:
+        return json_response(page, status=404)
+    page['results'] = await aserialize_recipes(recipes, request, fieldset)
+    return json_response(page)
+
+
+@async_read_view(recipe_detail_view)
+async def recipe_detail(request, pk):
+    return await aconditional(
+        request, lambda request: render_recipe_detail(request, pk))
+
+
+async def render_recipe_detail(request, pk):
+    if parse_id(pk) is None:
+        return json_response(NOT_FOUND, status=404)
+    fieldset = FieldSet.from_params(request.GET)
+    if feed_cache.is_cacheable_recipe(request):
+        try:
+            recipe = await sync_to_async(cached_recipe)(request, pk, fieldset)
+        except Http404:
+            return json_response(NOT_FOUND, status=404)
+        return json_response(recipe)
+    try:
+        recipe = await Recipe.objects.with_user_flags(request.user).values(
+            *fieldset.values()).aget(pk=pk)
+    except (Recipe.DoesNotExist, ValueError):
+        return json_response(NOT_FOUND, status=404)
+    recipes = await aserialize_recipes([recipe], request, fieldset)
+    return json_response(recipes[0])
+
+
+async def aconditional(request, render):
+    """Same as ``RecipeViewSet.conditional``."""
+    etag = await sync_to_async(recipe_etag)(request)
+    response = not_modified(request, etag)
+    if response is None:
+        response = await render(request)
+    return set_validators(response, etag)
+
+
+def cached_tags():
+    """The tag list, under the same key as ``TagViewSet.list``."""
+    def tags():
+        return TagSerializer(Tag.objects.all(), many=True).data
+
+    return cached(feed_cache.tags_key(), tags,
+                  settings.INGREDIENTS_CACHE_TIMEOUT, feed_cache.tag_stats)
+
+
+@async_read_view()
+async def tag_list(request):
+    return cache_compressed(json_response(
+        await sync_to_async(cached_tags)()))
+
+
+@async_read_view()
+async def tag_detail(request, pk):
+    try:
+        tag = await Tag.objects.aget(pk=pk)
+    except (Tag.DoesNotExist, ValueError):
+        return json_response(NOT_FOUND, status=404)
+    return json_response(TagSerializer(tag).data)
+
+
+def cached_ingredients(search):
+    """An ingredient search, under the same key as the sync view."""
+    def ingredients():
+        queryset = Ingredient.objects.all()
+        for term in search.replace('\x00', '').replace(',', ' ').split():
+            queryset = queryset.filter(name__istartswith=term)
+        return IngredientSerializer(queryset, many=True).data
+
+    return cached(feed_cache.ingredients_key(search), ingredients,
+                  settings.INGREDIENTS_CACHE_TIMEOUT,
+                  feed_cache.ingredient_stats)
+
+
+@async_read_view()
+async def ingredient_list(request):
+    search = request.GET.get(IngredientViewSet.filter_backends[0].search_param,
+                             '')
+    return cache_compressed(json_response(
+        await sync_to_async(cached_ingredients)(search)))
+
+
+@async_read_view()
+async def ingredient_detail(request, pk):
+    try:
+        ingredient = await Ingredient.objects.aget(pk=pk)
+    except (Ingredient.DoesNotExist, ValueError):
+        return json_response(NOT_FOUND, status=404)
+    return json_response(IngredientSerializer(ingredient).data)
@@ -0,0 +1,56 @@
+"""
+Conditional GET (ETag, 304) for recipe and user reads.
+
+Validators are computed without serializing anything. A recipe list or
+detail ETag reads no rows at all: it is the normalized query plus the cache
+generations of everything the payload is made of, ``recipes`` (any recipe,
+its tags or ingredients), ``users`` (author profiles), the ``tags`` and
+``ingredients`` reference data and ``viewer:<id>``, bumped when the
+viewer's favorites, cart or follows change (``recipes/signals.py``). A
+user's ETag comes from their own row. The viewer's id is part of the ETag
+since the flags differ per user.
+
+There is no Last-Modified: a timestamp cannot show that a recipe was
+deleted or a flag flipped, so If-Modified-Since would get a 304 for a page
+that changed.
+"""
+import hashlib
+
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from foodgram_backend.cache import get_generations
+
+
+def make_etag(user, *parts):
+    names = ['tags', 'ingredients']
+    if user.is_authenticated:
+        names.append(f'viewer:{user.id}')
+    signature = '|'.join(map(str, (user.id, *get_generations(*names),
+                                   *parts)))
+    return f'W/"{hashlib.md5(signature.encode()).hexdigest()}"'
+
+
+def recipe_etag(request):
+    """ETag of a recipe list or detail page, from its path and query."""
+    query = sorted(request.GET.lists())
+    return make_etag(request.user, *get_generations('recipes', 'users'),
+                     request.path, query)
+
+
+def user_etag(profile, user):
+    return make_etag(user, profile.id, profile.updated_at)
+
+
+def not_modified(request, etag):
+    """A 304 (or 412) response if the client's copy is current."""
+    return get_conditional_response(request, etag=etag)
+
+
+def set_validators(response, etag):
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    # Always revalidate; the payload depends on the Authorization header.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
@@ -0,0 +1,87 @@
+"""
+Short-lived caches of anonymous recipe feed pages and recipe details, the
+tag list, ingredient searches and subscription pages, all filled through
+``foodgram_backend.cache.cached``.
+
+The anonymous feed only depends on the tag/author filters and the page, so
+the id list of each page is cached under a normalized signature of those
+parameters. Keys embed the ``recipes`` generation, which is bumped on every
+recipe write (``recipes/signals.py``), so stale pages are never read after
+a change; they just expire. Recipe details also follow the generations of
+what they embed: authors, tags and ingredients. Tags and ingredient
+searches follow the ``tags`` and ``ingredients`` generations, subscription
+pages the recipes and the subscriber's follows. ``warm_caches`` fills them
+after a deploy.
+"""
+import hashlib
+
+from foodgram_backend.cache import (CacheStats, get_generation,
+                                    get_generations)
+
+FEED_PARAMS = frozenset(('tags', 'tags_mode', 'author', 'page', 'limit'))
+# Change only how the cached ids are rendered, so they stay out of the key.
+RENDER_PARAMS = frozenset(('fields', 'expand'))
+
+feed_stats = CacheStats('recipe_feed')
+recipe_stats = CacheStats('recipe_detail')
+tag_stats = CacheStats('tags')
+ingredient_stats = CacheStats('ingredients')
+subscription_stats = CacheStats('subscriptions')
+
+
+# The feed helpers read ``request.GET``: the async views (api/async_views.py)
+# share these entries with plain Django requests.
+def is_cacheable(request):
+    if request.user.is_authenticated:
+        return False
+    return set(request.GET) <= FEED_PARAMS | RENDER_PARAMS
+
+
+def feed_key(request, page_size):
+    params = request.GET
+    signature = '|'.join((
+        ','.join(sorted(set(params.getlist('tags')))),
+        params.get('tags_mode', 'any'),
+        params.get('author', ''),
+        params.get('page', '1'),
+        str(page_size),
+    ))
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    return f"recipe_feed:{get_generation('recipes')}:{digest}"
+
+
+def is_cacheable_recipe(request):
+    # Feed parameters filter the queryset a detail is looked up in.
+    if request.user.is_authenticated:
+        return False
+    return set(request.GET) <= RENDER_PARAMS
+
+
+def recipe_key(request, pk):
+    params = request.GET
+    signature = '|'.join((str(pk), params.get('fields', ''),
+                          params.get('expand', '')))
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    generations = get_generations('recipes', 'users', 'tags', 'ingredients')
+    return f"recipe:{':'.join(map(str, generations))}:{digest}"
+
+
+def tags_key():
+    return f"tags:{get_generation('tags')}"
+
+
+def ingredients_key(search):
+    digest = hashlib.md5(search.encode()).hexdigest()
+    return f"ingredients:{get_generation('ingredients')}:{digest}"
+
+
+def subscriptions_key(request, page_size):
+    user_id = request.user.id
+    signature = '|'.join((
+        request.query_params.get('page', '1'),
+        str(page_size),
+        request.query_params.get('recipes_limit', ''),
+    ))
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    return (f"subscriptions:{user_id}:{get_generation('recipes')}:"
+            f"{get_generation(f'follows:{user_id}')}:{digest}")
@@ -1,10 +1,41 @@
+from django import forms
 from django_filters.rest_framework import filters, FilterSet
-from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.db.models import Case, Exists, IntegerField, OuterRef, Value, When
 from rest_framework.filters import SearchFilter
+from recipes import ingredient_index
 from recipes.models import (Ingredient, Recipe, Tag,
                             RecipeShoppingList, FavoriteRecipe)
 
 
+# Primary keys are BigAutoField: anything outside this range cannot be one
+# and makes the database driver fail instead of matching nothing.
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_id(value):
+    """``value`` as a primary key, or None if no row can have it."""
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return None
+    return pk if 1 <= pk <= MAX_ID else None
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
+def in_order(queryset, ids):
+    """Recipes of ``ids``, ordered as listed."""
+    position = Case(
+        *(When(id=pk, then=Value(index)) for index, pk in enumerate(ids)),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(id__in=ids).annotate(
+        list_position=position).order_by('list_position')
+
+
 class IngredientFilter(SearchFilter):
     search_param = 'name'
 
@@ -13,15 +44,45 @@ class IngredientFilter(SearchFilter):
         fields = ('name',)
 
 
+class RecipeFilterForm(forms.Form):
+    def clean_ids(self):
+        ids = self.cleaned_data['ids']
+        # NumberFilter gives decimals: 1.5 is not an id either.
+        if ids and any(parse_id(pk) != pk for pk in ids):
+            raise forms.ValidationError(
+                f'Id рецепта — целое число от 1 до {MAX_ID}')
+        if ids and len(ids) > settings.RECIPE_IDS_MAX_COUNT:
+            raise forms.ValidationError(
+                f'Не больше {settings.RECIPE_IDS_MAX_COUNT} id за запрос')
+        return ids
+
+
 class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
+    )
+
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_mode',
+        label='Tags match mode'
     )
 
     author = filters.CharFilter(field_name='author_id')
 
+    have = NumberInFilter(
+        method='filter_have',
+        label='Ingredient ids at hand'
+    )
+
+    ids = NumberInFilter(
+        method='filter_ids',
+        label='Recipe ids, returned in this order'
+    )
+
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart',
         label='Is in shopping cart'
@@ -34,9 +95,52 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author',
+        form = RecipeFilterForm
+        fields = ['tags', 'tags_mode', 'author', 'have', 'ids',
                   'is_in_shopping_cart', 'is_favorited']
 
+    def filter_tags(self, queryset, name, tags):
+        """
+        Semi-join on the recipe/tag through table: a recipe with several
+        matching tags still appears once, without DISTINCT.
+        """
+        if not tags:
+            return queryset
+        through = Recipe.tags.through.objects
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            for tag in tags:
+                queryset = queryset.filter(Exists(through.filter(
+                    recipe_id=OuterRef('pk'), tag_id=tag.id)))
+            return queryset
+        return queryset.filter(Exists(through.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=[tag.id for tag in tags])))
+
+    def filter_tags_mode(self, queryset, name, value):
+        # Only changes how filter_tags matches.
+        return queryset
+
+    def filter_have(self, queryset, name, value):
+        """
+        Recipes that use any of the given ingredients, ordered by the share
+        of their ingredients that is already at hand.
+        """
+        if not value:
+            return queryset
+        ranked = ingredient_index.rank(
+            [int(pk) for pk in value], settings.HAVE_MAX_RESULTS)
+        if not ranked:
+            return queryset.none()
+        return in_order(queryset, ranked)
+
+    def filter_ids(self, queryset, name, value):
+        """
+        Multi-get: the listed recipes in the caller's order, unknown ids are
+        left out. They all fit on one page (see CustomPagination).
+        """
+        if not value:
+            return queryset
+        return in_order(queryset, list(dict.fromkeys(int(pk) for pk in value)))
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if not user.is_authenticated:
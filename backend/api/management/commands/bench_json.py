@@ -0,0 +1,73 @@
+import base64
+import io
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand
+from django.test import RequestFactory
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from recipes.models import Recipe
+from api.parsers import FastJSONParser
+from api.read_serializers import RECIPE_VALUES, serialize_recipes
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import RecipeSerializer
+
+
+class Command(BaseCommand):
+    help = ('Микробенчмарк страницы рецептов: RecipeSerializer против '
+            'serialize_recipes, рендеринг и разбор тела с картинкой '
+            'в base64 через stdlib json и orjson.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--image-kb', type=int, default=512)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                'orjson не установлен, FastJSON* работают через stdlib'))
+        repeat = options['repeat']
+        request = RequestFactory().get('/api/recipes/')
+        request.user = AnonymousUser()
+        size = options['page_size']
+        queryset = Recipe.objects.with_user_flags(request.user)
+        recipes = list(queryset.for_read()[:size])
+
+        seconds = timeit.timeit(
+            lambda: RecipeSerializer(
+                list(queryset.for_read()[:size]), many=True,
+                context={'request': request}).data,
+            number=repeat)
+        self.report('serialize RecipeSerializer', seconds, repeat)
+        seconds = timeit.timeit(
+            lambda: serialize_recipes(
+                queryset.values(*RECIPE_VALUES)[:size], request),
+            number=repeat)
+        self.report('serialize serialize_recipes', seconds, repeat)
+
+        page = {
+            'count': len(recipes),
+            'next': None,
+            'previous': None,
+            'results': RecipeSerializer(
+                recipes, many=True, context={'request': request}).data,
+        }
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            seconds = timeit.timeit(lambda: renderer.render(page),
+                                    number=repeat)
+            self.report(f'render {type(renderer).__name__}', seconds, repeat)
+
+        image = base64.b64encode(b'\0' * options['image_kb'] * 1024)
+        body = (b'{"name": "\xd0\xb1\xd0\xbe\xd1\x80\xd1\x89", "image": '
+                b'"data:image/png;base64,' + image + b'"}')
+        for parser in (JSONParser(), FastJSONParser()):
+            seconds = timeit.timeit(
+                lambda: parser.parse(io.BytesIO(body), 'application/json',
+                                     {'encoding': 'utf-8'}),
+                number=repeat)
+            self.report(f'parse {type(parser).__name__}', seconds, repeat)
+
+    def report(self, name, seconds, repeat):
+        self.stdout.write(f'{name}: {seconds / repeat * 1000:.3f} ms')
@@ -0,0 +1,52 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+from django.core.management import BaseCommand
+
+READ_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?limit=100',
+    '/api/recipes/1/',
+    '/api/tags/',
+    '/api/ingredients/?name=а',
+)
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер GET-эндпоинтов запущенного сервера. '
+            'Запускать с одинаковыми параметрами против WSGI и ASGI.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--token', default='')
+        parser.add_argument('--path', action='append', dest='paths')
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f"Token {options['token']}"
+        for path in options['paths'] or READ_PATHS:
+            url = options['base_url'].rstrip('/') + path
+            self.bench(url, headers, options['concurrency'],
+                       options['requests'])
+
+    def bench(self, url, headers, concurrency, total):
+        def fetch(_):
+            started = time.perf_counter()
+            with urlopen(Request(url, headers=headers)) as response:
+                response.read()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = sorted(pool.map(fetch, range(total)))
+        elapsed = time.perf_counter() - started
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{url}: {total / elapsed:.1f} rps, '
+            f'p50 {statistics.median(latencies) * 1000:.1f} ms, '
+            f'p95 {p95 * 1000:.1f} ms')
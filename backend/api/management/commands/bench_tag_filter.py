@@ -0,0 +1,92 @@
+import random
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import Recipe, Tag
+from users.models import User
+from api.filters import RecipeFilter
+
+BENCH_PREFIX = 'bench-tags-'
+BATCH_SIZE = 10_000
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает фильтр по тегам через JOIN + DISTINCT и через '
+            'EXISTS (режимы any/all): время count() и первой страницы. '
+            'С --generate сначала создаёт синтетические рецепты; '
+            'запускать только на отдельной базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, default=0,
+                            metavar='N', help='Создать N рецептов')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Удалить синтетические рецепты')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=6)
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.cleanup()
+            return
+        tags = list(Tag.objects.all())
+        if len(tags) < 2:
+            raise CommandError('Нужно хотя бы два тега (make_base_tags)')
+        if options['generate']:
+            self.generate(options['generate'], tags)
+
+        slugs = [tag.slug for tag in tags[:2]]
+        variants = {
+            'join+distinct': Recipe.objects.filter(
+                tags__slug__in=slugs).distinct(),
+            'exists any': RecipeFilter(
+                {'tags': slugs}, queryset=Recipe.objects.all()).qs,
+            'exists all': RecipeFilter(
+                {'tags': slugs, 'tags_mode': 'all'},
+                queryset=Recipe.objects.all()).qs,
+        }
+        repeat, page_size = options['repeat'], options['page_size']
+        for name, queryset in variants.items():
+            ids = queryset.values_list('id', flat=True)
+            count_ms = self.timed(queryset.count, repeat)
+            page_ms = self.timed(lambda: list(ids[:page_size]), repeat)
+            self.stdout.write(
+                f'{name}: count {count_ms} ms, page {page_ms} ms')
+
+    def timed(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return f'{min(timings) * 1000:.1f}'
+
+    def generate(self, total, tags):
+        author = User.objects.order_by('id').first()
+        if author is None:
+            raise CommandError('Нужен хотя бы один пользователь')
+        through = Recipe.tags.through
+        for start in range(0, total, BATCH_SIZE):
+            size = min(BATCH_SIZE, total - start)
+            with transaction.atomic():
+                recipes = Recipe.objects.bulk_create(
+                    Recipe(author=author, name=f'{BENCH_PREFIX}{start + i}',
+                           text='', cooking_time=random.randint(1, 480))
+                    for i in range(size))
+                through.objects.bulk_create(
+                    through(recipe_id=recipe.id, tag_id=tag.id)
+                    for recipe in recipes
+                    for tag in random.sample(
+                        tags, random.randint(1, min(3, len(tags)))))
+            self.stdout.write(f'Создано {start + size} из {total}')
+
+    def cleanup(self):
+        recipes = Recipe.objects.filter(name__startswith=BENCH_PREFIX)
+        deleted = 0
+        while True:
+            ids = list(recipes.values_list('id', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            Recipe.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+        self.stdout.write(f'Удалено рецептов: {deleted}')
@@ -0,0 +1,62 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+from foodgram_backend import slow_queries
+from foodgram_backend.cache import is_shared
+
+
+class Command(BaseCommand):
+    help = ('Показывает медленные SQL-запросы, записанные при '
+            'SLOW_QUERY_MS > 0, сгруппированные по отпечатку: сколько раз, '
+            'суммарное и максимальное время, откуда вызваны и план. '
+            'Записи хранятся в общем кэше, поэтому нужен REDIS_URL: кэш в '
+            'памяти воркера команде не виден.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help='Сколько отпечатков показать.')
+        parser.add_argument('--raw', action='store_true',
+                            help='Вывести записи как есть, по одной JSON '
+                                 'на строку.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Очистить буфер после вывода.')
+
+    def handle(self, *args, **options):
+        if not is_shared():
+            raise CommandError(
+                'Кэш локальный для процесса (нет REDIS_URL): записи '
+                'остаются в памяти воркеров и отсюда не видны.')
+        entries = slow_queries.entries()
+        if options['raw']:
+            for entry in entries:
+                self.stdout.write(json.dumps(entry, ensure_ascii=False))
+        else:
+            self.report(entries, options['top'])
+        if options['clear']:
+            slow_queries.clear()
+
+    def report(self, entries, top):
+        groups = {}
+        for entry in entries:
+            group = groups.setdefault(entry['fingerprint'], {
+                'sql': entry['sql'], 'count': 0, 'total': 0, 'max': 0,
+                'sources': set(), 'plan': None})
+            group['count'] += 1
+            group['total'] += entry['ms']
+            group['max'] = max(group['max'], entry['ms'])
+            group['sources'].add(f"{entry['view']} ← {entry['origin']}")
+            group['plan'] = entry['plan'] or group['plan']
+
+        ranked = sorted(groups.items(), key=lambda item: -item[1]['total'])
+        for digest, group in ranked[:top]:
+            self.stdout.write(self.style.WARNING(
+                f"{digest}: {group['count']} раз, всего "
+                f"{group['total']:.0f} мс, максимум {group['max']:.0f} мс"))
+            self.stdout.write(f"  {group['sql']}")
+            for source in sorted(group['sources']):
+                self.stdout.write(f'  {source}')
+            if group['plan']:
+                for line in group['plan'].splitlines():
+                    self.stdout.write(f'    {line}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей: {len(entries)}, отпечатков: {len(groups)}'))
@@ -0,0 +1,206 @@
+"""
+Read-only serialization of recipes and users straight from ``values()`` rows.
+
+Produces exactly the JSON of ``RecipeSerializer`` / ``CustomUserSerializer``
+for the GET endpoints, but without DRF field objects: every relation of a
+page is fetched with one flat ``values_list`` query and stitched in with
+dict lookups. Tags and ingredients are only fetched as ids from the through
+tables and filled in from the process-local ``recipes.reference`` registry.
+
+``?fields=`` limits the output to the listed top-level fields, and the
+columns, annotations and relation queries are limited to match. Listed
+relations are rendered as ids (ingredients as ``{id, amount}``, like the
+write payload) unless they are also named in ``?expand=``; without
+``?fields=`` everything is rendered in full.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import Exists, OuterRef, Value
+from recipes.models import Recipe, RecipeIngredient
+from recipes.reference import registry
+from users.models import Follow, User
+from .serializers import CustomUserSerializer, RecipeSerializer, TagSerializer
+
+USER_FIELDS = tuple(field for field in CustomUserSerializer.Meta.fields
+                    if field != 'is_subscribed')
+TAG_FIELDS = tuple(TagSerializer.Meta.fields)
+RECIPE_VALUES = ('id', 'name', 'image', 'text', 'cooking_time', 'servings',
+                 'author_id', 'is_favorited', 'is_in_shopping_cart',
+                 'author_is_subscribed')
+RECIPE_FIELDS = tuple(RecipeSerializer.Meta.fields)
+RECIPE_RELATIONS = ('tags', 'author', 'ingredients')
+
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def parse_list(value, allowed):
+    """Names from a comma separated parameter, in the order of ``allowed``."""
+    requested = set((value or '').split(','))
+    return tuple(name for name in allowed if name in requested)
+
+
+class FieldSet:
+    """Recipe fields asked for with ``?fields=`` and ``?expand=``."""
+
+    def __init__(self, fields=RECIPE_FIELDS, expand=RECIPE_RELATIONS):
+        self.fields = fields
+        self.expand = frozenset(expand)
+
+    @classmethod
+    def from_params(cls, params):
+        fields = parse_list(params.get('fields'), RECIPE_FIELDS)
+        if not fields:
+            return cls()
+        return cls(fields, parse_list(params.get('expand'), RECIPE_RELATIONS))
+
+    def wants(self, field):
+        return field in self.fields
+
+    def expands(self, relation):
+        return relation in self.fields and relation in self.expand
+
+    def values(self):
+        """Columns and annotations ``values()`` needs for these fields."""
+        columns = ['id']
+        if self.wants('author'):
+            columns.append('author_id')
+        if self.expands('author'):
+            columns.append('author_is_subscribed')
+        columns.extend(field for field in RECIPE_VALUES
+                       if field in self.fields and field != 'id')
+        return columns
+
+
+ALL_FIELDS = FieldSet()
+
+
+def is_subscribed_to(user, author_ref='pk'):
+    """Exists() expression telling whether ``user`` follows the author."""
+    if not user.is_authenticated:
+        return Value(False)
+    return Exists(Follow.objects.filter(author=OuterRef(author_ref),
+                                        subscriber=user))
+
+
+def user_rows(queryset, user, fields=()):
+    """``values()`` rows that already are the CustomUserSerializer JSON."""
+    fields = fields or CustomUserSerializer.Meta.fields
+    if 'is_subscribed' in fields:
+        queryset = queryset.annotate(is_subscribed=is_subscribed_to(user))
+    return queryset.values(*fields)
+
+
+def user_fields(params):
+    """Fields of ``CustomUserSerializer`` asked for with ``?fields=``."""
+    return parse_list(params.get('fields'), CustomUserSerializer.Meta.fields)
+
+
+def related_querysets(rows, fieldset):
+    """Queries for the relations in ``fieldset``, keyed by field name."""
+    recipe_ids = [row['id'] for row in rows]
+    related = {}
+    if fieldset.expands('author'):
+        related['author'] = User.objects.filter(
+            id__in={row['author_id'] for row in rows}
+        ).values_list(*USER_FIELDS)
+    if fieldset.wants('tags'):
+        related['tags'] = Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values_list('recipe_id', 'tag_id')
+    if fieldset.wants('ingredients'):
+        related['ingredients'] = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values_list('recipe_id', 'ingredient_id', 'amount')
+    return related
+
+
+def referenced_ids(related, fieldset):
+    """Tag and ingredient ids to look up in the reference registry."""
+    tag_ids = ({tag_id for _, tag_id in related['tags']}
+               if fieldset.expands('tags') else set())
+    ingredient_ids = ({ingredient_id
+                       for _, ingredient_id, _ in related['ingredients']}
+                      if fieldset.expands('ingredients') else set())
+    return tag_ids, ingredient_ids
+
+
+def build_recipes(rows, request, fieldset, related, reference):
+    recipes = {row['id']: {} for row in rows}
+    if 'author' in related:
+        authors = {}
+        for values in related['author']:
+            author = dict(zip(USER_FIELDS, values))
+            authors[author['id']] = author
+    if 'tags' in related:
+        tags = {row['id']: [] for row in rows}
+        for recipe_id, tag_id in related['tags']:
+            if not fieldset.expands('tags'):
+                tags[recipe_id].append(tag_id)
+                continue
+            tag = reference.tags[tag_id]
+            tags[recipe_id].append({field: getattr(tag, field)
+                                    for field in TAG_FIELDS})
+    if 'ingredients' in related:
+        ingredients = {row['id']: [] for row in rows}
+        for recipe_id, ingredient_id, amount in related['ingredients']:
+            if not fieldset.expands('ingredients'):
+                ingredients[recipe_id].append(
+                    {'id': ingredient_id, 'amount': amount})
+                continue
+            ingredient = reference.ingredients[ingredient_id]
+            ingredients[recipe_id].append({
+                'id': ingredient_id,
+                'name': ingredient.name,
+                'amount': amount,
+                'measurement_unit': ingredient.measurement_unit,
+            })
+
+    for row in rows:
+        recipe = recipes[row['id']]
+        for field in fieldset.fields:
+            if field == 'author':
+                recipe[field] = (
+                    {**authors[row['author_id']],
+                     'is_subscribed': row['author_is_subscribed']}
+                    if fieldset.expands('author') else row['author_id'])
+            elif field == 'tags':
+                recipe[field] = tags[row['id']]
+            elif field == 'ingredients':
+                recipe[field] = ingredients[row['id']]
+            elif field == 'image':
+                recipe[field] = image_url(row['image'], request)
+            else:
+                recipe[field] = row[field]
+    return [recipes[row['id']] for row in rows]
+
+
+def image_url(name, request):
+    if not name:
+        return None
+    url = image_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def serialize_recipes(rows, request, fieldset=ALL_FIELDS):
+    """
+    ``rows`` are ``fieldset.values()`` dicts of a queryset annotated with
+    ``Recipe.objects.with_user_flags``; returns RecipeSerializer output.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    related = {field: list(queryset) for field, queryset
+               in related_querysets(rows, fieldset).items()}
+    reference = registry.get(*referenced_ids(related, fieldset))
+    return build_recipes(rows, request, fieldset, related, reference)
+
+
+async def aserialize_recipes(rows, request, fieldset=ALL_FIELDS):
+    """Same as ``serialize_recipes`` using the async ORM."""
+    if not rows:
+        return []
+    related = {}
+    for field, queryset in related_querysets(rows, fieldset).items():
+        related[field] = [values async for values in queryset]
+    reference = await sync_to_async(registry.get)(
+        *referenced_ids(related, fieldset))
+    return build_recipes(rows, request, fieldset, related, reference)
@@ -0,0 +1,58 @@
+import math
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def has_non_finite(data):
+    """Whether a NaN or an infinity sits anywhere in ``data``."""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, (float, Decimal)):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson.
+
+    Output is the same as the stock renderer: compact, non-ASCII left as is,
+    dates and times, Decimal, lazy strings and other extras handled by DRF's
+    encoder. Falls back to the stdlib path when orjson isn't installed, an
+    indent is requested or the data holds a NaN or an infinity, which orjson
+    would quietly turn into null (the stock renderer refuses them under
+    ``STRICT_JSON``).
+    """
+
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+               if orjson else 0)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if orjson is None or self.ensure_ascii or indent:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        ret = orjson.dumps(data, default=self.encoder_class().default,
+                           option=self.options)
+        # Without a null in the output nothing was non-finite.
+        if b'null' in ret and has_non_finite(data):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Same JS-safety escaping as JSONRenderer.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
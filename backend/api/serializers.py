@@ -11,8 +11,30 @@ from recipes.models import (
     RecipeShoppingList,
     Tag
 )
+from recipes.model_variables import AMOUNT_DECIMAL_PLACES, AMOUNT_MAX_DIGITS
+from recipes.signals import ingredients_changed
 from users.models import Follow, User
 from django.core.exceptions import PermissionDenied
+from .uploads import IMAGE_UPLOAD_FORMATS, resolve_image_reference
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Accepts either a base64 data URI or a reference returned by
+    ``POST /api/recipes/images/``.
+    """
+
+    default_error_messages = {
+        'unknown_reference': 'Изображение не найдено, загрузите его заново',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and not data.startswith(('data:', 'http')):
+            name = resolve_image_reference(data)
+            if name is None:
+                self.fail('unknown_reference')
+            return name
+        return super().to_internal_value(data)
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -43,7 +65,17 @@ class CustomUserCreateSerializer(UserCreateSerializer):
 class CustomUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
+    def get_fields(self):
+        fields = super().get_fields()
+        only = self.context.get('fields')
+        if only:
+            return {name: field for name, field in fields.items()
+                    if name in only}
+        return fields
+
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return Follow.objects.filter(
             subscriber=request.user,
@@ -84,6 +116,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         source='ingredient.measurement_unit',
         read_only=True
     )
+    amount = serializers.FloatField(read_only=True)
 
     class Meta:
         model = RecipeIngredient
@@ -96,7 +129,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    image = serializers.ImageField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -119,9 +152,16 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ['id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time']
+                  'name', 'image', 'text', 'cooking_time', 'servings']
+
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'author_is_subscribed'):
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+        return super().to_representation(recipe)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
 
         return (FavoriteRecipe.objects.filter(
@@ -129,6 +169,8 @@ class RecipeSerializer(serializers.ModelSerializer):
             if request and not request.user.is_anonymous else False)
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
 
         return (RecipeShoppingList.objects.filter(
@@ -140,7 +182,8 @@ class IngredientAddRecipeSerializer(serializers.ModelSerializer):
     id = serializers.PrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(),
         source='ingredient')
-    amount = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=AMOUNT_MAX_DIGITS,
+                                      decimal_places=AMOUNT_DECIMAL_PLACES)
 
     class Meta:
         model = RecipeIngredient
@@ -155,14 +198,14 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         queryset=Tag.objects.all(),
         many=True
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
     author = CustomUserSerializer(read_only=True)
 
     class Meta:
         model = Recipe
         fields = ['id', 'ingredients', 'tags',
                   'image', 'name', 'text',
-                  'cooking_time', 'author']
+                  'cooking_time', 'servings', 'author']
 
     def _validate_recipe_creation(self, tags, ingredients, cooking_time):
         if not tags:
@@ -179,10 +222,10 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             ingredient_in = ingredient['ingredient']
             if not amount:
                 raise ValidationError("Добавьте количество для ингридиента")
-            elif amount < 1:
+            elif amount < 0:
                 raise ValidationError(f"Количество ингридиента"
                                       f" '{ingredient_in.name}' "
-                                      f" не может быть меньше 1 штуки")
+                                      f" не может быть отрицательным")
             if ingredient_in in ing_set:
                 raise ValidationError(f"Ингридиенты не должны дублироваться"
                                       f" '{ingredient_in.name}' повторяется")
@@ -196,6 +239,10 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
                 amount=ingredient['amount']
             ) for ingredient in ingredients
         )
+        # bulk_create sends no signals.
+        ingredients_changed(
+            [recipe.pk],
+            [ingredient['ingredient'].id for ingredient in ingredients])
 
     def create(self, validated_data):
         author = self.context.get('request').user
@@ -377,7 +424,8 @@ class RecipeShoppingListSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         recipe_shopping_list = RecipeShoppingList(
             user=self.context['request'].user,
-            recipe=validated_data['recipe']
+            recipe=validated_data['recipe'],
+            servings=validated_data.get('servings')
         )
         recipe_shopping_list.save()
         return recipe_shopping_list
@@ -392,7 +440,7 @@ class RecipeShoppingListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RecipeShoppingList
-        fields = ['id', 'user', 'recipe', 'date_added']
+        fields = ['id', 'user', 'recipe', 'date_added', 'servings']
         validators = [
             UniqueTogetherValidator(
                 queryset=RecipeShoppingList.objects.all(),
@@ -403,3 +451,13 @@ class RecipeShoppingListSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         result = RecipeShortSerializer(instance.recipe).data
         return result
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    image = serializers.ImageField(write_only=True)
+
+    def validate_image(self, image):
+        if image.image.format not in IMAGE_UPLOAD_FORMATS:
+            raise ValidationError(
+                f"Допустимые форматы: {', '.join(IMAGE_UPLOAD_FORMATS)}")
+        return image
@@ -0,0 +1,543 @@
+import datetime
+import gzip
+import hashlib
+import io
+import shutil
+import tempfile
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from foodgram_backend.cache import bump_generation
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, RecipeShoppingList,
+                            SimilarRecipe, Tag)
+from recipes import nutrition
+from recipes.reference import registry
+from users.models import Follow, User
+from . import async_views, feed_cache
+from .read_serializers import (ALL_FIELDS, FieldSet, serialize_recipes,
+                               user_rows)
+from .renderers import FastJSONRenderer
+from .serializers import CustomUserSerializer, RecipeSerializer
+from .views import RecipeViewSet
+
+
+class FastJSONRendererTests(SimpleTestCase):
+
+    def assertSameJSON(self, data):
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    def test_same_output_as_drf(self):
+        self.assertSameJSON({
+            'created': datetime.datetime(2024, 1, 2, 3, 4, 5, 678901,
+                                         tzinfo=datetime.timezone.utc),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5),
+            'day': datetime.date(2024, 1, 2),
+            'time': datetime.time(3, 4, 5, 678901),
+            'amount': Decimal('0.125'),
+            'label': gettext_lazy('Ингредиенты'),
+            'nested': [{'id': 1, 'tags': (1, 2)}, None, 'строка\u2028'],
+            'next': None,
+        })
+
+    def test_non_finite_floats_are_refused(self):
+        for value in (float('nan'), float('inf'), Decimal('-Infinity')):
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render({'results': [{'kcal': value}]})
+
+    def test_non_finite_floats_when_not_strict(self):
+        renderer, stock = FastJSONRenderer(), JSONRenderer()
+        renderer.strict = stock.strict = False
+        data = {'kcal': float('nan'), 'next': None}
+        self.assertEqual(renderer.render(data), stock.render(data))
+
+
+class SlowQueriesCommandTests(SimpleTestCase):
+
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaises(CommandError):
+            call_command('slow_queries')
+
+
+class ReadSerializerParityTests(TestCase):
+    """``read_serializers`` must render exactly what the serializers do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Первый')
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Второй')
+        Follow.objects.create(subscriber=cls.reader, author=cls.author)
+        breakfast = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                       slug='breakfast')
+        dinner = Tag.objects.create(name='Ужин', color='#49B64E',
+                                    slug='dinner')
+        flour = Ingredient.objects.create(name='мука',
+                                          measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко',
+                                         measurement_unit='мл')
+        salt = Ingredient.objects.create(name='соль',
+                                         measurement_unit='щепотка')
+        for number, (author, tags, amounts) in enumerate((
+                (cls.author, [dinner, breakfast],
+                 [(milk, '0.1'), (flour, '250')]),
+                (cls.reader, [breakfast], [(salt, '1.5')]),
+                (cls.author, [], []))):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image=f'recipes/images/{number}.png', text='Описание',
+                cooking_time=10 + number, servings=number + 1)
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=Decimal(amount))
+                for ingredient, amount in amounts)
+            if number == 0:
+                FavoriteRecipe.objects.create(user=cls.reader,
+                                              recipe=recipe)
+                RecipeShoppingList.objects.create(user=cls.reader,
+                                                  recipe=recipe)
+
+    def setUp(self):
+        # Ids are reused between tests on some databases.
+        registry.snapshot = None
+
+    def request(self, user):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        return request
+
+    def render(self, data):
+        return FastJSONRenderer().render(data)
+
+    def test_recipes(self):
+        for user in (AnonymousUser(), self.reader):
+            request = self.request(user)
+            queryset = Recipe.objects.with_user_flags(user)
+            expected = RecipeSerializer(queryset.for_read(), many=True,
+                                        context={'request': request}).data
+            rows = queryset.values(*ALL_FIELDS.values())
+            self.assertEqual(self.render(serialize_recipes(rows, request)),
+                             self.render(expected))
+
+    def test_recipe_fields(self):
+        request = self.request(self.reader)
+        queryset = Recipe.objects.with_user_flags(self.reader)
+        full = RecipeSerializer(queryset.for_read(), many=True,
+                                context={'request': request}).data
+        fieldset = FieldSet(('id', 'author', 'tags', 'ingredients'),
+                            ('author',))
+        recipes = serialize_recipes(
+            queryset.values(*fieldset.values()), request, fieldset)
+        for recipe, expected in zip(recipes, full):
+            self.assertEqual(recipe['author'], expected['author'])
+            self.assertEqual(recipe['tags'],
+                             [tag['id'] for tag in expected['tags']])
+            self.assertEqual(
+                self.render(recipe['ingredients']),
+                self.render([{'id': ingredient['id'],
+                              'amount': ingredient['amount']}
+                             for ingredient in expected['ingredients']]))
+
+    def test_users(self):
+        for user in (AnonymousUser(), self.reader):
+            request = self.request(user)
+            queryset = User.objects.order_by('id')
+            expected = CustomUserSerializer(
+                queryset, many=True, context={'request': request}).data
+            self.assertEqual(self.render(list(user_rows(queryset, user))),
+                             self.render(expected))
+
+    def test_list_endpoint(self):
+        token = Token.objects.create(user=self.reader)
+        response = self.client.get(
+            '/api/recipes/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        request = self.request(self.reader)
+        expected = RecipeSerializer(
+            Recipe.objects.with_user_flags(self.reader).for_read(),
+            many=True, context={'request': request}).data
+        self.assertEqual(response.json()['results'],
+                         [dict(recipe) for recipe in expected])
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.reader = User.objects.create(username='reader',
+                                         email='reader@example.com')
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.recipes = [
+            Recipe.objects.create(author=cls.author, name=f'Рецепт {number}',
+                                  image='recipes/images/a.png',
+                                  text='Описание', cooking_time=5)
+            for number in range(2)]
+
+    def get(self, path, etag=None, **headers):
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(path, **headers)
+
+    def assertChanges(self, path, write, **headers):
+        etag = self.get(path, **headers)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(self.get(path, etag, **headers).status_code,
+                            304)
+
+    def test_unchanged_list_is_not_read(self):
+        response = self.get('/api/recipes/')
+        self.assertNotIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.get('/api/recipes/', response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_emptied_cache_does_not_revive_old_etags(self):
+        # Counters restarting from the same value after the cache is
+        # emptied would climb back to the ETags of older content.
+        cache.clear()
+        bump_generation('recipes')
+        etag = self.get('/api/recipes/')['ETag']
+        cache.clear()
+        bump_generation('recipes')
+        self.assertEqual(self.get('/api/recipes/', etag).status_code, 200)
+
+    def test_query_is_part_of_the_etag(self):
+        etag = self.get('/api/recipes/?limit=1&page=2')['ETag']
+        self.assertEqual(
+            self.get('/api/recipes/?page=2&limit=1', etag).status_code, 304)
+        for query in ('?limit=1&page=1', '?limit=1&page=2&fields=id',
+                      f'?limit=1&page=2&author={self.author.pk}'):
+            self.assertEqual(
+                self.get(f'/api/recipes/{query}', etag).status_code, 200)
+
+    def test_deleted_recipe(self):
+        self.assertChanges('/api/recipes/', self.recipes[0].delete)
+        path = f'/api/recipes/{self.recipes[1].pk}/'
+        self.assertChanges(path, self.recipes[1].delete)
+
+    def test_author_profile_change(self):
+        def rename():
+            self.author.first_name = 'Автор'
+            self.author.save()
+        self.assertChanges(f'/api/recipes/{self.recipes[0].pk}/', rename)
+
+    def test_viewer_flags(self):
+        self.assertChanges(
+            '/api/recipes/',
+            lambda: FavoriteRecipe.objects.create(user=self.reader,
+                                                  recipe=self.recipes[0]),
+            HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+
+class AsyncViewCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        Recipe.objects.create(author=author, name='Рецепт',
+                              image='recipes/images/a.png', text='Описание',
+                              cooking_time=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_async_views_read_the_sync_entries(self):
+        for path, view, stats in (
+                ('/api/recipes/', async_views.recipe_list,
+                 feed_cache.feed_stats),
+                ('/api/tags/', async_views.tag_list, feed_cache.tag_stats),
+                ('/api/ingredients/?name=му', async_views.ingredient_list,
+                 feed_cache.ingredient_stats)):
+            with self.subTest(path=path):
+                expected = self.client.get(path).content
+                response = async_to_sync(view)(RequestFactory().get(path))
+                self.assertEqual(response.content, expected)
+                snapshot = stats.snapshot()
+                self.assertEqual((snapshot['miss'], snapshot['hit']), (1, 1))
+
+
+class RecipeLookupTests(TestCase):
+
+    def test_impossible_ids_are_not_found(self):
+        for pk in ('abc', '0', '99999999999999999999'):
+            for path in (f'/api/recipes/{pk}/',
+                         f'/api/recipes/{pk}/similar/'):
+                with self.subTest(path=path):
+                    response = self.client.get(path)
+                    self.assertEqual(response.status_code, 404)
+        response = async_to_sync(async_views.recipe_detail)(
+            RequestFactory().get('/api/recipes/'), pk=10 ** 20)
+        self.assertEqual(response.status_code, 404)
+
+    def test_similar_recipes_in_score_order(self):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        recipe, first, second = (
+            Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                  image='recipes/images/a.png',
+                                  text='Описание', cooking_time=5)
+            for number in range(3))
+        SimilarRecipe.objects.bulk_create([
+            SimilarRecipe(recipe=recipe, similar=second, score=0.2),
+            SimilarRecipe(recipe=recipe, similar=first, score=0.9)])
+        response = self.client.get(f'/api/recipes/{recipe.pk}/similar/')
+        self.assertEqual([item['id'] for item in response.json()],
+                         [first.pk, second.pk])
+        response = self.client.get(f'/api/recipes/{second.pk}/similar/')
+        self.assertEqual(response.json(), [])
+
+
+class RecipeMultiGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        flour = Ingredient.objects.create(name='мука', measurement_unit='г')
+        cls.recipes = [
+            Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                  image='recipes/images/a.png',
+                                  text='Описание', cooking_time=5)
+            for number in range(3)]
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=flour, amount=100)
+            for recipe in cls.recipes)
+
+    def setUp(self):
+        registry.snapshot = None
+
+    def get(self, query):
+        return self.client.get(f'/api/recipes/?{query}')
+
+    def ids(self, query):
+        return [recipe['id'] for recipe in self.get(query).json()['results']]
+
+    def test_caller_order_without_unknown_ids(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        self.assertEqual(self.ids(f'ids={third},999,{first},{third}'),
+                         [third, first])
+
+    @override_settings(RECIPE_IDS_MAX_COUNT=2)
+    def test_too_many_ids(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        self.assertEqual(self.get(f'ids={first},{second}').status_code, 200)
+        self.assertEqual(
+            self.get(f'ids={first},{second},{third}').status_code, 400)
+
+    def test_impossible_ids(self):
+        for ids in ('99999999999999999999999', '0', '1.5'):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.get(f'ids={ids}').status_code, 400)
+
+    def test_empty_ids_are_ignored(self):
+        self.assertEqual(len(self.ids('ids=&limit=2')), 2)
+
+    def test_recipes_are_read_in_one_pass(self):
+        self.get(f'ids={self.recipes[0].pk}')
+        queries = []
+        for recipes in (self.recipes[:1], self.recipes):
+            with CaptureQueriesContext(connection) as captured:
+                self.ids('ids=' + ','.join(str(recipe.pk)
+                                           for recipe in recipes))
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+
+class ShoppingListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader',
+                                         email='reader@example.com')
+        cls.token = Token.objects.create(user=cls.reader)
+        flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г', kcal=3.5, protein=0.1,
+            fat=0.01, carbs=0.7, price=0.05)
+        recipe = Recipe.objects.create(
+            author=cls.reader, name='Хлеб', image='recipes/images/a.png',
+            text='Описание', cooking_time=5, servings=2)
+        milk = Ingredient.objects.create(name='молоко',
+                                         measurement_unit='л')
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=flour,
+                                        amount=200)
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=milk,
+                                        amount=Decimal('0.35'))
+        nutrition.refresh([recipe.pk])
+        RecipeShoppingList.objects.create(user=cls.reader, recipe=recipe,
+                                          servings=4)
+        cls.other = User.objects.create(username='other',
+                                        email='other@example.com')
+        RecipeShoppingList.objects.create(user=cls.other, recipe=recipe,
+                                          servings=3)
+
+    def get(self, query='', **headers):
+        return self.client.get(
+            f'/api/recipes/download_shopping_cart/{query}',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}', **headers)
+
+    def download(self, query=''):
+        return b''.join(self.get(query).streaming_content).decode()
+
+    def assertCart(self, user, ingredients, kcal):
+        view = RecipeViewSet()
+        with self.assertNumQueries(1):
+            found = list(view.get_ingredients(user))
+        self.assertEqual([row[:2] for row in found],
+                         [row[:2] for row in ingredients])
+        for row, expected in zip(found, ingredients):
+            self.assertAlmostEqual(row[2], expected[2])
+        with self.assertNumQueries(1):
+            self.assertAlmostEqual(view.get_totals(user)['kcal'], kcal)
+
+    def test_amounts_follow_each_carts_servings(self):
+        # The same recipe (2 servings) is bought for 4 and for 3.
+        self.assertCart(self.reader,
+                        [('молоко', 'мл', 700), ('мука', 'г', 400)], 1400)
+        self.assertCart(self.other,
+                        [('молоко', 'мл', 525), ('мука', 'г', 300)], 1050)
+
+    def test_compressed_download(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)).decode(),
+            self.download())
+
+    def test_totals_footer(self):
+        self.assertNotIn('Итого', self.download())
+        self.assertTrue(self.download('?totals=1').endswith(
+            '\n\nИтого: 1400 ккал, белки 40.0 г, жиры 4.0 г, '
+            'углеводы 280.0 г, стоимость 20.00'))
+
+
+class RecipeTagFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        cls.tags = [Tag.objects.create(name=slug, color=color, slug=slug)
+                    for slug, color in (('breakfast', '#E26C2D'),
+                                        ('dinner', '#49B64E'),
+                                        ('dessert', '#8775D2'))]
+        breakfast, dinner, dessert = cls.tags
+        for number, tags in enumerate(([breakfast], [breakfast, dinner],
+                                       [dinner, dessert], [], [dessert])):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image='recipes/images/a.png', text='Описание',
+                cooking_time=5)
+            recipe.tags.set(tags)
+
+    def ids(self, query):
+        response = self.client.get(f'/api/recipes/?limit=100&{query}')
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_same_recipes_as_joins(self):
+        recipes = Recipe.objects.order_by('-id')
+        breakfast, dinner, dessert = self.tags
+        for tags in ([breakfast], [breakfast, dinner],
+                     [breakfast, dinner, dessert]):
+            slugs = '&'.join(f'tags={tag.slug}' for tag in tags)
+            with self.subTest(tags=slugs):
+                any_tag = recipes.filter(tags__in=tags).distinct()
+                self.assertEqual(self.ids(slugs),
+                                 [recipe.pk for recipe in any_tag])
+                all_tags = recipes
+                for tag in tags:
+                    all_tags = all_tags.filter(tags=tag)
+                self.assertEqual(
+                    self.ids(f'{slugs}&tags_mode=all'),
+                    [recipe.pk for recipe in all_tags.distinct()])
+
+    def test_unknown_mode(self):
+        response = self.client.get('/api/recipes/?tags=dinner&tags_mode=some')
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.token = Token.objects.create(user=cls.author)
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.flour = Ingredient.objects.create(name='мука',
+                                              measurement_unit='г')
+        image = io.BytesIO()
+        Image.new('RGB', (2, 2), 'red').save(image, 'PNG')
+        cls.png = image.getvalue()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post(self, path, data, **kwargs):
+        return self.client.post(
+            path, data, HTTP_AUTHORIZATION=f'Token {self.token.key}',
+            **kwargs)
+
+    def upload(self, name='photo.png'):
+        return self.post('/api/recipes/images/', {
+            'image': SimpleUploadedFile(name, self.png, 'image/png')})
+
+    def create_recipe(self, image):
+        return self.post('/api/recipes/', {
+            'name': 'Блины', 'text': 'Описание', 'cooking_time': 20,
+            'image': image, 'tags': [self.tag.pk],
+            'ingredients': [{'id': self.flour.pk, 'amount': '200'}],
+        }, content_type='application/json')
+
+    def test_upload_is_named_by_content(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201)
+        reference = response.json()['image']
+        self.assertEqual(reference,
+                         f'{hashlib.sha256(self.png).hexdigest()}.png')
+        self.assertTrue(response.json()['url'].endswith(reference))
+        self.assertEqual(self.upload('again.png').json()['image'],
+                         reference)
+
+    def test_recipe_from_reference(self):
+        reference = self.upload().json()['image']
+        response = self.create_recipe(reference)
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        self.assertEqual(recipe.image.name, f'recipes/images/{reference}')
+
+    def test_unknown_or_malformed_reference(self):
+        for reference in (f'{"0" * 64}.png', 'photo.png',
+                          f'../{hashlib.sha256(self.png).hexdigest()}.png'):
+            with self.subTest(reference=reference):
+                response = self.create_recipe(reference)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('image', response.json())
@@ -0,0 +1,69 @@
+"""
+Streaming image uploads for recipes.
+
+``POST /api/recipes/images/`` takes a multipart ``image`` file. The body is
+streamed to a temporary file chunk by chunk while being hashed, then moved
+into the content-addressed media storage, so identical images are stored
+once. The returned reference (``<sha256>.<ext>``) is passed as ``image`` when
+creating or updating a recipe instead of a base64 string.
+"""
+import hashlib
+import posixpath
+import re
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from recipes.models import Recipe
+
+IMAGE_UPLOAD_FORMATS = ('GIF', 'JPEG', 'PNG', 'WEBP')
+IMAGE_REFERENCE_RE = re.compile(
+    r'^[0-9a-f]{64}\.(%s)$' % '|'.join(IMAGE_UPLOAD_FORMATS).lower())
+
+image_field = Recipe._meta.get_field('image')
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Writes uploads to a temp file and computes their SHA-256 on the fly."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+def image_name(reference):
+    return posixpath.join(image_field.upload_to, reference)
+
+
+def store_image(file, image_format):
+    """
+    Saves a validated upload (the storage names it by content hash and
+    skips the write for known content). Returns the reference to attach
+    to a recipe.
+    """
+    name = image_field.storage.save(
+        image_name(f'upload.{image_format.lower()}'), file)
+    return posixpath.basename(name)
+
+
+def resolve_image_reference(reference):
+    """
+    Storage name of a previously uploaded image, or None. The file is
+    touched so that the garbage collector leaves it alone until it is
+    attached.
+    """
+    if not IMAGE_REFERENCE_RE.match(reference):
+        return None
+    name = image_name(reference)
+    try:
+        image_field.storage.touch(name)
+    except FileNotFoundError:
+        return None
+    return name
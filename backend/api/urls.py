@@ -1,10 +1,13 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from .views import (
     IngredientViewSet,
     RecipeViewSet,
     TagViewSet,
-    CustomUserViewSet
+    CustomUserViewSet,
+    CacheStatsView,
+    SyncView
 )
 
 app_name = 'api'
@@ -16,7 +19,23 @@ router.register(r'recipes', RecipeViewSet, basename='recipes')
 router.register(r'users', CustomUserViewSet, basename='users')
 
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASYNC_READ_VIEWS:
+    from . import async_views
+
+    urlpatterns += [
+        path('recipes/', async_views.recipe_list),
+        path('recipes/<int:pk>/', async_views.recipe_detail),
+        path('tags/', async_views.tag_list),
+        path('tags/<int:pk>/', async_views.tag_detail),
+        path('ingredients/', async_views.ingredient_list),
+        path('ingredients/<int:pk>/', async_views.ingredient_detail),
+    ]
+
+urlpatterns += [
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('sync/', SyncView.as_view(), name='sync'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
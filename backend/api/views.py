@@ -1,44 +1,97 @@
+from django.conf import settings
 from django.contrib.auth.hashers import make_password, check_password
-from django.http.response import HttpResponse
+from django.core.paginator import Page
+from django.http import Http404
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets, mixins
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from foodgram_backend.cache import all_stats, cached
+from foodgram_backend.compression import cache_compressed
+from recipes import changelog, nutrition, units
+from . import feed_cache
+from .conditional import not_modified, recipe_etag, set_validators, user_etag
 from .serializers import (CustomUserSerializer,
                           FavoriteRecipeSerializer,
+                          ImageUploadSerializer,
                           IngredientSerializer,
                           RecipeCreateUpdateSerializer,
                           RecipeSerializer,
+                          RecipeShortSerializer,
                           RecipeShoppingListSerializer,
                           SubscriptionsSerializer,
                           TagSerializer)
-from .filters import IngredientFilter, RecipeFilter
-from recipes.models import (Ingredient, Recipe, Tag,
+from .filters import IngredientFilter, RecipeFilter, parse_id
+from .read_serializers import (FieldSet, image_url, serialize_recipes,
+                               user_fields, user_rows)
+from .uploads import HashingUploadHandler, image_name, store_image
+from recipes.models import (ChangeLogEntry, Ingredient, Recipe, Tag,
                             RecipeIngredient, RecipeShoppingList,
-                            FavoriteRecipe)
+                            FavoriteRecipe, RecommendedRecipe,
+                            SimilarRecipe)
 from users.models import Follow, User
 from rest_framework.pagination import PageNumberPagination
 from .permissions import AuthorOnly
-from django.db.models import F, Sum
+from django.db import transaction
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import Coalesce
+
+
+def servings_scale(recipe_path=''):
+    """Portions to buy for a recipe in the cart it is joined with."""
+    return Coalesce(F(f'{recipe_path}recipeshoppinglist__servings'),
+                    F(f'{recipe_path}servings'))
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     max_page_size = 100
 
+    def get_page_size(self, request):
+        # A multi-get (?ids=) answers with every requested recipe at once;
+        # an empty one filters nothing and pages as usual.
+        if request.query_params.get('ids'):
+            return settings.RECIPE_IDS_MAX_COUNT
+        return super().get_page_size(request)
+
+    def restore_page(self, request, objects, count, number):
+        """Pagination state for a page whose objects come from the cache."""
+        self.request = request
+        paginator = self.django_paginator_class(
+            range(count), self.get_page_size(request))
+        self.page = Page(objects, number, paginator)
+
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     pagination_class = CustomPagination
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(user_rows(
+            queryset, request.user, user_fields(request.query_params)))
+        return self.get_paginated_response(list(page))
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(),
+                'fields': user_fields(self.request.query_params)}
+
     def retrieve(self, request, *args, **kwargs):
         if request.user.is_anonymous and request.path.endswith('/me/'):
             return Response({'Ошибка': 'Неавторизован'},
                             status=status.HTTP_401_UNAUTHORIZED)
-        return super().retrieve(request, *args, **kwargs)
+        profile = self.get_object()
+        etag = user_etag(profile, request.user)
+        response = not_modified(request, etag)
+        if response is None:
+            response = Response(self.get_serializer(profile).data)
+        return set_validators(response, etag)
 
     @action(methods=['POST'],
             detail=False,
@@ -70,6 +123,7 @@ class CustomUserViewSet(UserViewSet):
 
     @action(methods=['POST', 'DELETE'], detail=True,
             permission_classes=[permissions.IsAuthenticated])
+    @transaction.atomic
     def subscribe(self, request, id):
         user = request.user
         author = get_object_or_404(User, id=id)
@@ -101,12 +155,41 @@ class CustomUserViewSet(UserViewSet):
     def subscriptions(self, request):
         if request.user.is_anonymous or not request.user.is_authenticated:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        subscriptions = Follow.objects.filter(subscriber=request.user)
-        page = self.paginate_queryset(subscriptions)
-        serializer = SubscriptionsSerializer(
-            page, many=True,
-            context={'request': request})
-        return self.get_paginated_response(serializer.data)
+
+        def subscriptions_page():
+            page = self.paginate_queryset(
+                Follow.objects.filter(subscriber=request.user))
+            serializer = SubscriptionsSerializer(
+                page, many=True,
+                context={'request': request})
+            return {'results': serializer.data,
+                    'count': self.paginator.page.paginator.count,
+                    'number': self.paginator.page.number}
+
+        entry = cached(
+            feed_cache.subscriptions_key(
+                request, self.paginator.get_page_size(request)),
+            subscriptions_page, settings.SUBSCRIPTIONS_CACHE_TIMEOUT,
+            feed_cache.subscription_stats)
+        self.paginator.restore_page(request, entry['results'],
+                                    entry['count'], entry['number'])
+        return self.get_paginated_response(entry['results'])
+
+
+def cached_recipe(request, pk, fieldset):
+    """An anonymous recipe detail, shared with the async view."""
+    def recipe():
+        # Http404 leaves nothing cached.
+        row = get_object_or_404(Recipe.objects.with_user_flags(
+            request.user).filter(pk=pk).values(*fieldset.values()))
+        # Stored with a relative image URL: the host is the request's.
+        return serialize_recipes([row], None, fieldset)[0]
+
+    entry = cached(feed_cache.recipe_key(request, pk), recipe,
+                   settings.RECIPE_CACHE_TIMEOUT, feed_cache.recipe_stats)
+    if entry.get('image'):
+        entry = {**entry, 'image': request.build_absolute_uri(entry['image'])}
+    return entry
 
 
 class RecipeViewSet(mixins.CreateModelMixin,
@@ -123,33 +206,155 @@ class RecipeViewSet(mixins.CreateModelMixin,
     pagination_class = CustomPagination
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'similar']:
             return (permissions.AllowAny(),)
         elif self.action == 'destroy':
             return (AuthorOnly(), )
         return super().get_permissions()
 
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            return Recipe.objects.with_user_flags(self.request.user)
+        return super().get_queryset()
+
+    def conditional(self, request, render):
+        """``render()``, or 304 if the client has these recipes already."""
+        etag = recipe_etag(request)
+        response = not_modified(request, etag) or render()
+        return set_validators(response, etag)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: self.list_page(request))
+
+    def list_page(self, request):
+        if feed_cache.is_cacheable(request):
+            return self.list_cached_feed(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        fieldset = FieldSet.from_params(request.query_params)
+        page = self.paginate_queryset(queryset.values(*fieldset.values()))
+        return self.get_paginated_response(
+            serialize_recipes(page, request, fieldset))
+
+    def list_cached_feed(self, request):
+        def page_ids():
+            queryset = self.filter_queryset(self.get_queryset())
+            ids = self.paginate_queryset(queryset.values_list('id', flat=True))
+            return {'ids': list(ids),
+                    'count': self.paginator.page.paginator.count,
+                    'number': self.paginator.page.number}
+
+        entry = cached(
+            feed_cache.feed_key(request,
+                                self.paginator.get_page_size(request)),
+            page_ids, settings.FEED_CACHE_TIMEOUT, feed_cache.feed_stats)
+        self.paginator.restore_page(request, entry['ids'], entry['count'],
+                                    entry['number'])
+        fieldset = FieldSet.from_params(request.query_params)
+        rows = {row['id']: row for row in self.get_queryset().filter(
+            id__in=entry['ids']).values(*fieldset.values())}
+        return self.get_paginated_response(serialize_recipes(
+            [rows[pk] for pk in entry['ids'] if pk in rows], request,
+            fieldset))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            request, lambda: self.retrieve_row(request, kwargs['pk']))
+
+    def retrieve_row(self, request, pk):
+        if parse_id(pk) is None:
+            raise Http404
+        fieldset = FieldSet.from_params(request.query_params)
+        if feed_cache.is_cacheable_recipe(request):
+            return Response(cached_recipe(request, pk, fieldset))
+        queryset = self.filter_queryset(self.get_queryset()).filter(pk=pk)
+        recipe = get_object_or_404(queryset.values(*fieldset.values()))
+        return Response(serialize_recipes([recipe], request, fieldset)[0])
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializer
         return RecipeCreateUpdateSerializer
 
+    # Writes are atomic so their change log entries commit with them.
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+
     def get_ingredients(self, user_name):
+        # Amounts are scaled by the cart entry's servings in the same
+        # GROUP BY, joined through the cart row the filter already needs.
+        amount = F('amount') * F('ingredient__unit_factor')
+        amount = amount * servings_scale('recipe__') / F('recipe__servings')
         ingredients = RecipeIngredient.objects.filter(
-            recipe__in=RecipeShoppingList.objects.filter(
-                user__username=user_name
-            ).values_list('recipe')
+            recipe__recipeshoppinglist__user__username=user_name
         ).values(
-            name=F('ingredient__name'),
-            unit=F('ingredient__measurement_unit')
-        ).annotate(amount=Sum('amount')).values_list(
-            'ingredient__name', 'ingredient__measurement_unit', 'amount')
+            'ingredient__name', 'ingredient__base_unit'
+        ).annotate(
+            amount=Sum(amount, output_field=FloatField())
+        ).order_by('ingredient__name').values_list(
+            'ingredient__name', 'ingredient__base_unit', 'amount')
         return ingredients
 
+    def get_totals(self, user):
+        return Recipe.objects.filter(
+            recipeshoppinglist__user=user
+        ).aggregate(**{
+            field: Sum(F(field) * servings_scale() / F('servings'),
+                       output_field=FloatField())
+            for field in nutrition.FIELDS})
+
+    @action(detail=False, methods=['POST'], url_path='images',
+            parser_classes=[MultiPartParser])
+    def upload_image(self, request):
+        request.upload_handlers = [HashingUploadHandler(request)]
+        serializer = ImageUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file = serializer.validated_data['image']
+        reference = store_image(file, file.image.format)
+        return Response(
+            {'image': reference,
+             'url': image_url(image_name(reference), request)},
+            status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=[permissions.IsAuthenticated])
+    def recommended(self, request):
+        recommendations = RecommendedRecipe.objects.filter(user=request.user)
+        if not recommendations.exists():
+            recommendations = RecommendedRecipe.objects.filter(user=None)
+        queryset = self.get_queryset().filter(
+            recommended_for__in=recommendations
+        ).order_by('-recommended_for__score', '-id')
+        fieldset = FieldSet.from_params(request.query_params)
+        page = self.paginate_queryset(queryset.values(*fieldset.values()))
+        return self.get_paginated_response(
+            serialize_recipes(page, request, fieldset))
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk=None):
+        if parse_id(pk) is None:
+            raise Http404
+        neighbours = SimilarRecipe.objects.filter(
+            recipe_id=pk).select_related('similar').order_by(
+                '-score', '-similar_id')
+        if not neighbours and not Recipe.objects.filter(pk=pk).exists():
+            return Response({'detail': 'Страница не найдена.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        serializer = RecipeShortSerializer(
+            [neighbour.similar for neighbour in neighbours], many=True,
+            context={'request': request})
+        return Response(serializer.data)
+
     @action(detail=True, methods=['POST', 'DELETE'])
+    @transaction.atomic
     def favorite(self, request, pk=None):
         if request.method == 'POST':
             return self._add_to_favorite(request, pk)
@@ -194,6 +399,7 @@ class RecipeViewSet(mixins.CreateModelMixin,
                             status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['POST', 'DELETE'])
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         if request.method == 'POST':
             return self._add_to_shopping_cart(request, pk)
@@ -214,7 +420,8 @@ class RecipeViewSet(mixins.CreateModelMixin,
             return Response("Рецепт уже в корзине",
                             status=status.HTTP_400_BAD_REQUEST)
 
-        data = {'user': user.id, 'recipe': recipe.id}
+        data = {'user': user.id, 'recipe': recipe.id,
+                'servings': request.data.get('servings')}
         context = {'request': request}
         serializer = RecipeShoppingListSerializer(data=data, context=context)
 
@@ -240,18 +447,39 @@ class RecipeViewSet(mixins.CreateModelMixin,
 
     @action(detail=False, permission_classes=[AuthorOnly])
     def download_shopping_cart(self, request):
-        ingredients = self.get_ingredients(request.user)
-        shopping_list = 'Список покупок:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n- {ingredient[0]} "
-                f"({ingredient[1]}) - "
-                f"{ingredient[2]}")
         file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        response = StreamingHttpResponse(
+            self.shopping_list_lines(request), content_type='text/plain')
         response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
         return response
 
+    def shopping_list_lines(self, request):
+        # Runs while the response is sent: keep the database chosen now,
+        # it may be the primary the request is pinned to.
+        ingredients = self.get_ingredients(request.user)
+        ingredients = ingredients.using(ingredients.db)
+        totals = (self.get_totals(request.user)
+                  if request.query_params.get('totals') in ('1', 'true')
+                  else None)
+        return self.render_shopping_list(ingredients, totals)
+
+    @staticmethod
+    def render_shopping_list(ingredients, totals):
+        yield 'Список покупок:'
+        for name, base_unit, total in ingredients.iterator():
+            amount, unit = units.humanize(total, base_unit)
+            line = f"\n- {name} ({unit})"
+            if amount:
+                line += f" - {amount}"
+            yield line
+        if totals is not None:
+            totals = {field: value or 0 for field, value in totals.items()}
+            yield (f"\n\nИтого: {totals['kcal']:.0f} ккал, "
+                   f"белки {totals['protein']:.1f} г, "
+                   f"жиры {totals['fat']:.1f} г, "
+                   f"углеводы {totals['carbs']:.1f} г, "
+                   f"стоимость {totals['price']:.2f}")
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
@@ -259,6 +487,14 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
 
+    def list(self, request, *args, **kwargs):
+        def tags():
+            return self.get_serializer(self.get_queryset(), many=True).data
+
+        return cache_compressed(Response(cached(
+            feed_cache.tags_key(), tags, settings.INGREDIENTS_CACHE_TIMEOUT,
+            feed_cache.tag_stats)))
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -267,3 +503,83 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.AllowAny,)
     filter_backends = (IngredientFilter,)
     search_fields = ('^name', )
+
+    def list(self, request, *args, **kwargs):
+        def ingredients():
+            return self.get_serializer(
+                self.filter_queryset(self.get_queryset()), many=True).data
+
+        return cache_compressed(Response(cached(
+            feed_cache.ingredients_key(
+                request.query_params.get(IngredientFilter.search_param, '')),
+            ingredients, settings.INGREDIENTS_CACHE_TIMEOUT,
+            feed_cache.ingredient_stats)))
+
+
+class CacheStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(all_stats())
+
+
+class SyncView(APIView):
+    """
+    Changes since ``?since=<cursor>``: recipes updated or deleted, and the
+    user's favorites, cart entries and subscriptions added or removed.
+    Without a cursor, or with one older than the compacted log, answers
+    ``reset`` with the current cursor: the client reloads everything and
+    syncs from there.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        if since is None:
+            return self.reset()
+        try:
+            cursor = int(since)
+            if cursor < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'since': 'Неверный курсор'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if cursor < changelog.horizon():
+            return self.reset()
+
+        changes, cursor, has_more = changelog.changes_since(
+            cursor, request.user, settings.SYNC_BATCH_SIZE,
+            settings.SYNC_SAFETY_LAG)
+        changed = {kind: ([], []) for kind, _ in ChangeLogEntry.KINDS}
+        for (kind, target_id), deleted in sorted(changes.items()):
+            changed[kind][deleted].append(target_id)
+
+        updated, deleted = changed[ChangeLogEntry.RECIPE]
+        fieldset = FieldSet.from_params(request.query_params)
+        recipes = serialize_recipes(
+            Recipe.objects.with_user_flags(request.user).filter(
+                id__in=updated).order_by('id').values(*fieldset.values()),
+            request, fieldset)
+        # Deleted after the last entry of this batch: the tombstone follows.
+        found = {recipe['id'] for recipe in recipes}
+        deleted += [recipe_id for recipe_id in updated
+                    if recipe_id not in found]
+
+        added, removed = changed[ChangeLogEntry.CART]
+        cart = list(RecipeShoppingList.objects.filter(
+            user=request.user, recipe_id__in=added
+        ).order_by('recipe_id').values('recipe', 'servings'))
+        return Response({
+            'cursor': cursor,
+            'has_more': has_more,
+            'reset': False,
+            'recipes': {'updated': recipes, 'deleted': sorted(deleted)},
+            'favorites': dict(zip(('added', 'removed'),
+                                  changed[ChangeLogEntry.FAVORITE])),
+            'shopping_cart': {'added': cart, 'removed': removed},
+            'subscriptions': dict(zip(('added', 'removed'),
+                                      changed[ChangeLogEntry.FOLLOW])),
+        })
+
+    def reset(self):
+        return Response({'cursor': changelog.latest_cursor(), 'reset': True})
@@ -0,0 +1,163 @@
+"""
+Helpers shared by the response and result caches.
+
+Generations: every cached family of keys embeds a counter that writers bump
+instead of deleting keys one by one, so invalidation is a single ``incr``.
+Counters start from the current time in nanoseconds, so once the cache is
+emptied (Redis keeps nothing across deploys) they never climb back to a
+value handed out before, which ETags held by clients may still embed.
+Single flight: ``cached`` lets one caller at a time recompute an expired
+entry while the others keep serving the stale value.
+Stats: hit/stale/miss counters kept in the shared cache, so they add up
+across worker processes.
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Weight of the early refresh: above 1 refreshes earlier, below 1 later.
+REFRESH_BETA = 1.0
+# How often a caller without a value checks whether the lease holder is done.
+LEASE_POLL_INTERVAL = 0.05
+
+
+def is_shared():
+    """Whether other processes see this cache: not without REDIS_URL."""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def initial_generation():
+    return time.time_ns()
+
+
+def get_generation(name):
+    return cache.get_or_set(f'generation:{name}', initial_generation,
+                            timeout=None)
+
+
+def get_generations(*names):
+    """``get_generation`` of several names in one round trip."""
+    keys = [f'generation:{name}' for name in names]
+    found = cache.get_many(keys)
+    return [found.get(key) or get_generation(name)
+            for key, name in zip(keys, names)]
+
+
+def bump_generation(name):
+    key = f'generation:{name}'
+    cache.add(key, initial_generation(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr().
+        generation = initial_generation()
+        cache.set(key, generation, timeout=None)
+        return generation
+
+
+def increment(key):
+    """Counter shared by all processes; returns the new value."""
+    if cache.add(key, 1, timeout=None):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr().
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def cached(key, compute, timeout, stats):
+    """
+    ``compute()`` cached under ``key`` for ``timeout`` seconds.
+
+    Entries are kept ``CACHE_STALE_GRACE`` seconds past their expiry. Once
+    expired, the caller that takes the key's lease recomputes it and the
+    others are served the stale value meanwhile; without any value they
+    wait up to ``CACHE_LEASE_WAIT`` seconds for the lease holder. Refresh
+    also starts early at random, the more likely the closer the expiry and
+    the longer computing took (XFetch), so popular keys rarely expire.
+    """
+    lease = f'lease:{key}'
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires_at, cost = entry
+        early = cost * REFRESH_BETA * -math.log(1 - random.random())
+        if time.time() + early < expires_at:
+            stats.hit()
+            return value
+        if not cache.add(lease, 1, timeout=settings.CACHE_LEASE_TIMEOUT):
+            if time.time() < expires_at:
+                stats.hit()
+            else:
+                stats.stale()
+            return value
+        return recompute(key, compute, timeout, stats, lease)
+
+    if cache.add(lease, 1, timeout=settings.CACHE_LEASE_TIMEOUT):
+        return recompute(key, compute, timeout, stats, lease)
+    deadline = time.monotonic() + settings.CACHE_LEASE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LEASE_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            stats.hit()
+            return entry[0]
+    # The lease holder is too slow or gone: compute without it.
+    return recompute(key, compute, timeout, stats)
+
+
+def recompute(key, compute, timeout, stats, lease=None):
+    stats.miss()
+    started = time.monotonic()
+    try:
+        value = compute()
+        cache.set(key, (value, time.time() + timeout,
+                        time.monotonic() - started),
+                  timeout + settings.CACHE_STALE_GRACE)
+    finally:
+        if lease:
+            cache.delete(lease)
+    return value
+
+
+class CacheStats:
+    events = ('hit', 'stale', 'miss')
+    registry = {}
+
+    def __init__(self, name):
+        self.name = name
+        self.registry[name] = self
+
+    def record(self, event):
+        increment(f'stats:{self.name}:{event}')
+
+    def hit(self):
+        self.record('hit')
+
+    def stale(self):
+        self.record('stale')
+
+    def miss(self):
+        self.record('miss')
+
+    def snapshot(self):
+        counts = cache.get_many(
+            [f'stats:{self.name}:{event}' for event in self.events])
+        result = {event: counts.get(f'stats:{self.name}:{event}', 0)
+                  for event in self.events}
+        total = sum(result.values())
+        # Stale answers are served from the cache too.
+        served = result['hit'] + result['stale']
+        result['hit_rate'] = round(served / total, 4) if total else None
+        return result
+
+
+def all_stats():
+    return {name: stats.snapshot()
+            for name, stats in sorted(CacheStats.registry.items())}
@@ -0,0 +1,159 @@
+"""
+Response compression: brotli or gzip, whichever the client accepts.
+
+Bodies under ``COMPRESSION_MIN_SIZE`` bytes and non-text content are sent
+as is; streaming responses are compressed chunk by chunk. Responses marked
+with ``cache_compressed`` serve the same bytes to everyone (tag and
+ingredient lists), so their compressed bodies are kept in the shared cache
+under a digest of the body and compressed once per version, at the highest
+level, instead of once per request. Brotli needs the ``Brotli`` package;
+without it only gzip is offered.
+"""
+import gzip
+import hashlib
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml')
+# Per-request levels trade ratio for latency; cached bodies get the best.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def cache_compressed(response):
+    response.cache_compressed = True
+    return response
+
+
+def accepted_encodings(header):
+    """Codings of an Accept-Encoding header that are not refused (q=0)."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    wildcard = accepted.get('*', 0.0)
+    return {coding for coding in ('br', 'gzip')
+            if accepted.get(coding, wildcard) > 0}
+
+
+def negotiate(request):
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING',
+                                                   ''))
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(coding, data, best=False):
+    if coding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL,
+                         mtime=0)
+
+
+def compressor(coding):
+    """``(compress, finish)`` functions of an incremental compressor."""
+    if coding == 'br':
+        stream = brotli.Compressor(quality=BROTLI_QUALITY)
+        return stream.process, stream.finish
+    stream = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return stream.compress, stream.flush
+
+
+def compress_stream(coding, chunks):
+    process, finish = compressor(coding)
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def acompress_stream(coding, chunks):
+    process, finish = compressor(coding)
+    async for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def cached_compress(coding, content):
+    key = f'compressed:{coding}:{hashlib.md5(content).hexdigest()}'
+    body = cache.get(key)
+    if body is None:
+        body = compress(coding, content, best=True)
+        cache.set(key, body, settings.COMPRESSION_CACHE_TIMEOUT)
+    return body
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request,
+                                     await self.get_response(request))
+
+    def process_response(self, request, response):
+        if (response.status_code != 200 or response.has_header(
+                'Content-Encoding') or not response.get(
+                'Content-Type', '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+        if not response.streaming and (
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate(request)
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(
+                    coding, response.streaming_content)
+            else:
+                response.streaming_content = compress_stream(
+                    coding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            if getattr(response, 'cache_compressed', False):
+                response.content = cached_compress(coding, response.content)
+            else:
+                response.content = compress(coding, response.content)
+            response['Content-Length'] = str(len(response.content))
+        # The compressed body is another representation of the same data.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
@@ -0,0 +1,115 @@
+"""
+Primary/replica routing for the foodgram database aliases.
+
+Writes always go to ``default``. Reads go to one of the aliases listed in
+``settings.DATABASE_REPLICAS`` unless the current request is pinned to the
+primary: unsafe requests are pinned for their whole duration, and a client
+that has just written stays pinned for ``REPLICA_PIN_SECONDS`` so it reads
+its own writes while the replicas catch up.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY_DB = 'default'
+PIN_COOKIE_NAME = 'db_pin'
+
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def is_pinned():
+    return _pinned_to_primary.get()
+
+
+@contextmanager
+def pin_to_primary():
+    """Send every read inside the block to the primary."""
+    token = _pinned_to_primary.set(True)
+    try:
+        yield
+    finally:
+        _pinned_to_primary.reset(token)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or is_pinned():
+            return PRIMARY_DB
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {PRIMARY_DB, *get_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pins the request to the primary when it writes or when the client wrote
+    less than ``REPLICA_PIN_SECONDS`` ago (tracked with a signed cookie).
+    """
+
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        writes = request.method not in self.safe_methods
+        if not (writes or self._recently_wrote(request)):
+            return self.get_response(request)
+        with pin_to_primary():
+            response = self.get_response(request)
+        return self._remember_write(request, response)
+
+    async def __acall__(self, request):
+        writes = request.method not in self.safe_methods
+        if not (writes or self._recently_wrote(request)):
+            return await self.get_response(request)
+        with pin_to_primary():
+            response = await self.get_response(request)
+        return self._remember_write(request, response)
+
+    def _remember_write(self, request, response):
+        wrote = request.method not in self.safe_methods
+        if wrote and response.status_code < 400:
+            pin_seconds = settings.REPLICA_PIN_SECONDS
+            response.set_signed_cookie(
+                PIN_COOKIE_NAME,
+                str(time.time() + pin_seconds),
+                max_age=pin_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    @staticmethod
+    def _recently_wrote(request):
+        pinned_until = request.get_signed_cookie(PIN_COOKIE_NAME, None)
+        try:
+            return float(pinned_until) > time.time()
+        except (TypeError, ValueError):
+            return False
@@ -0,0 +1,29 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Below this many rows an exact COUNT(*) is cheap enough.
+EXACT_COUNT_LIMIT = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin changelist paginator that takes the row count of an unfiltered
+    table from PostgreSQL statistics instead of running COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if query.where or connection.vendor != 'postgresql':
+            return super().count
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [self.object_list.model._meta.db_table])
+            row = cursor.fetchone()
+        estimate = row[0] if row else -1
+        if estimate < EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
@@ -51,10 +51,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram_backend.slow_queries.SlowQueryMiddleware',
+    'foodgram_backend.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram_backend.db_router.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +85,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
+ASGI_APPLICATION = 'foodgram_backend.asgi.application'
+
+# Serve recipe, tag and ingredient reads from the async views in
+# api/async_views.py; only worth it under an ASGI server.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
 
 
 # Database
@@ -97,6 +105,26 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', 5432)
     }
 }
+
+# Read replicas: comma-separated hosts in DB_REPLICA_HOSTS become
+# replica_1, replica_2, ... aliases with the primary's credentials.
+# In tests every replica mirrors ``default``, so routing can be checked
+# against the local test database without extra services.
+DATABASE_REPLICAS = []
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['foodgram_backend.db_router.PrimaryReplicaRouter']
+
+# How long a client keeps reading from the primary after a write.
+REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -104,6 +132,72 @@ DATABASES = {
 #     }
 # }
 
+# Shared cache. Without REDIS_URL every worker process has its own
+# in-memory cache: invalidation then only reaches the writing process, so
+# gunicorn.conf.py refuses to start more than one worker without it.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds an anonymous feed page id list stays cached (api/feed_cache.py).
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', 30))
+# Anonymous recipe details; longer, any write changes their key anyway.
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 300))
+# Same for the tag list and ingredient searches, and subscription pages.
+INGREDIENTS_CACHE_TIMEOUT = int(os.getenv('INGREDIENTS_CACHE_TIMEOUT', 600))
+SUBSCRIPTIONS_CACHE_TIMEOUT = int(
+    os.getenv('SUBSCRIPTIONS_CACHE_TIMEOUT', 30))
+
+# Statements slower than this many milliseconds are recorded with their
+# plans (foodgram_backend/slow_queries.py, see the slow_queries command);
+# 0 turns the capture off. A plan per statement every EXPLAIN_INTERVAL s.
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 0))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv('SLOW_QUERY_BUFFER_SIZE', 500))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(
+    os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+
+# Responses shorter than this are not compressed, and how long compressed
+# tag and ingredient lists are kept (foodgram_backend/compression.py).
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_CACHE_TIMEOUT = int(os.getenv('COMPRESSION_CACHE_TIMEOUT', 600))
+
+# Single flight of foodgram_backend.cache.cached: how long an expired entry
+# is still served while one worker recomputes it, how long that worker
+# holds the lease, and how long callers without any value wait for it.
+CACHE_STALE_GRACE = int(os.getenv('CACHE_STALE_GRACE', 60))
+CACHE_LEASE_TIMEOUT = int(os.getenv('CACHE_LEASE_TIMEOUT', 10))
+CACHE_LEASE_WAIT = float(os.getenv('CACHE_LEASE_WAIT', 2))
+
+# How many best-covered recipes /api/recipes/?have=... can page through.
+HAVE_MAX_RESULTS = int(os.getenv('HAVE_MAX_RESULTS', 500))
+
+# Most recipes one /api/recipes/?ids=... multi-get may ask for.
+RECIPE_IDS_MAX_COUNT = int(os.getenv('RECIPE_IDS_MAX_COUNT', 100))
+
+# Neighbours stored per recipe for /api/recipes/<id>/similar/.
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', 10))
+
+# Recommendations stored per user for /api/recipes/recommended/.
+RECOMMENDED_RECIPES_COUNT = int(os.getenv('RECOMMENDED_RECIPES_COUNT', 50))
+
+# Change log entries read per /api/sync/ call, and how long tombstones are
+# kept by compact_change_log before stale clients have to resync.
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 500))
+SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', 30))
+# Seconds /api/sync/ holds back the newest entries: an entry takes its id
+# just before it commits, so a smaller id may still show up that long.
+SYNC_SAFETY_LAG = int(os.getenv('SYNC_SAFETY_LAG', 2))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -111,6 +205,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS':
     'rest_framework.pagination.PageNumberPagination',
     "PAGE_SIZE": 6,
@@ -180,6 +283,17 @@ MEDIA_ROOT = BASE_DIR / 'media/'
 STATIC_URL = '/static/django/'
 STATIC_ROOT = BASE_DIR / 'static_backend/'
 
+# Media files are named by content hash (see recipes/storage.py), which lets
+# nginx serve them with immutable far-future caching.
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,208 @@
+"""
+Opt-in capture of slow SQL statements (``SLOW_QUERY_MS`` > 0).
+
+Every database connection gets an execute wrapper timing its statements.
+One slower than the threshold is recorded with a fingerprint of its
+normalized SQL, the view of the current request and the innermost project
+function that ran it (``RecipeFilter.filter_have``,
+``SubscriptionsSerializer.get_recipes``...). Records go to a ring buffer of
+``SLOW_QUERY_BUFFER_SIZE`` slots in the shared cache, read by the
+``slow_queries`` command, which therefore needs REDIS_URL.
+
+SELECTs also get their plan: ``EXPLAIN (ANALYZE, BUFFERS)`` on PostgreSQL,
+plain ``EXPLAIN`` elsewhere, run in a background thread so the request does
+not wait. ANALYZE runs the statement again, so each fingerprint is explained
+at most once per ``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds, and at most
+``EXPLAIN_QUEUE`` plans are pending at a time.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .cache import increment
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_QUEUE = 4
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+IN_LISTS = re.compile(r'IN \((?:\?, )*\?\)')
+# ``in_order`` ranks ids with one WHEN per id, identical once folded.
+REPEATED_WHENS = re.compile(r'(WHEN .+? THEN \? )\1+')
+PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+ORIGIN_EXCLUDED = (__file__, 'site-packages')
+
+_request = ContextVar('slow_query_request', default=None)
+_explaining = ContextVar('slow_query_explaining', default=False)
+explainer = ThreadPoolExecutor(max_workers=1,
+                               thread_name_prefix='slow-query-explain')
+explain_slots = threading.BoundedSemaphore(EXPLAIN_QUEUE)
+
+
+def fingerprint(sql):
+    """``(digest, normalized SQL)``: literals and id lists folded."""
+    normalized = ' '.join(LITERALS.sub('?', sql).split())
+    normalized = REPEATED_WHENS.sub(r'\1... ',
+                                    IN_LISTS.sub('IN (...)', normalized))
+    return hashlib.md5(normalized.encode()).hexdigest()[:16], normalized
+
+
+def origin():
+    """Innermost project function on the stack, as ``path:line name``."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if (code.co_filename.startswith(PROJECT_ROOT) and not any(
+                part in code.co_filename for part in ORIGIN_EXCLUDED)):
+            path = code.co_filename[len(PROJECT_ROOT):]
+            name = code.co_name
+            owner = frame.f_locals.get('self')
+            if owner is not None:
+                name = f'{type(owner).__name__}.{name}'
+            return f'{path}:{frame.f_lineno} {name}'
+        frame = frame.f_back
+    return ''
+
+
+def view_name():
+    request = _request.get()
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name
+    return request.path if request is not None else ''
+
+
+def slot_key(seq):
+    return f'slow_queries:{seq % settings.SLOW_QUERY_BUFFER_SIZE}'
+
+
+def push(entry):
+    entry['seq'] = increment('slow_queries:cursor')
+    cache.set(slot_key(entry['seq']), entry, timeout=None)
+    return entry['seq']
+
+
+def entries():
+    """Recorded statements, oldest first."""
+    slots = cache.get_many([f'slow_queries:{slot}' for slot
+                            in range(settings.SLOW_QUERY_BUFFER_SIZE)])
+    return sorted(slots.values(), key=lambda entry: entry['seq'])
+
+
+def clear():
+    cache.delete_many(['slow_queries:cursor'] + [
+        f'slow_queries:{slot}'
+        for slot in range(settings.SLOW_QUERY_BUFFER_SIZE)])
+
+
+def explain(alias, sql, params, seq):
+    token = _explaining.set(True)
+    connection = connections[alias]
+    try:
+        options = ({'analyze': True, 'buffers': True}
+                   if connection.vendor == 'postgresql' else {})
+        prefix = connection.ops.explain_query_prefix(**options)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+        entry = cache.get(slot_key(seq))
+        # The slot may have been reused while the plan was running.
+        if entry is not None and entry['seq'] == seq:
+            entry['plan'] = plan
+            cache.set(slot_key(seq), entry, timeout=None)
+    except Exception:
+        logger.exception('EXPLAIN of a slow query failed')
+    finally:
+        connection.close()
+        _explaining.reset(token)
+        explain_slots.release()
+
+
+def record(alias, sql, params, many, elapsed):
+    digest, normalized = fingerprint(sql)
+    seq = push({
+        'fingerprint': digest,
+        'sql': normalized,
+        'ms': round(elapsed * 1000, 1),
+        'view': view_name(),
+        'origin': origin(),
+        'at': time.time(),
+        'plan': None,
+    })
+    statement = sql.lstrip().upper()
+    explainable = statement.startswith(('SELECT', 'WITH'))
+    if many or not explainable or ' FOR UPDATE' in statement:
+        return
+    if not cache.add(f'slow_queries:explained:{digest}', 1,
+                     settings.SLOW_QUERY_EXPLAIN_INTERVAL):
+        return
+    if explain_slots.acquire(blocking=False):
+        explainer.submit(explain, alias, sql, params, seq)
+
+
+def capture(execute, sql, params, many, context):
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            try:
+                record(context['connection'].alias, sql, params, many,
+                       elapsed)
+            except Exception:
+                logger.exception('Could not record a slow query')
+
+
+def instrument(sender, connection, **kwargs):
+    if capture not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture)
+
+
+class SlowQueryMiddleware:
+    """
+    Remembers the current request for the records and instruments every
+    database connection; not loaded at all while ``SLOW_QUERY_MS`` is 0.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_MS:
+            raise MiddlewareNotUsed
+        connection_created.connect(instrument)
+        for connection in connections.all(initialized_only=True):
+            instrument(None, connection)
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+    async def __acall__(self, request):
+        token = _request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _request.reset(token)
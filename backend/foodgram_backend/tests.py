@@ -0,0 +1,359 @@
+import gzip
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from rest_framework.serializers import ModelSerializer
+from api.serializers import CustomUserCreateSerializer, TagSerializer
+from recipes.models import Ingredient, Recipe
+from users.models import User
+from . import cache as cache_module, compression, paginators, warmup
+from .cache import cached
+from .compression import CompressionMiddleware, cache_compressed
+from .db_router import (PIN_COOKIE_NAME, PRIMARY_DB, PrimaryReplicaRouter,
+                        ReplicaPinningMiddleware, is_pinned, pin_to_primary)
+
+REPLICAS = ['replica_1', 'replica_2']
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_replicas(self):
+        self.assertIn(self.router.db_for_read(Recipe), REPLICAS)
+        self.assertIn(Recipe.objects.all().db, REPLICAS)
+
+    def test_writes_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Recipe), PRIMARY_DB)
+
+    def test_pinned_reads_go_to_primary(self):
+        with pin_to_primary():
+            self.assertEqual(self.router.db_for_read(Recipe), PRIMARY_DB)
+            self.assertEqual(Recipe.objects.all().db, PRIMARY_DB)
+        self.assertIn(self.router.db_for_read(Recipe), REPLICAS)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_reads_go_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Recipe), PRIMARY_DB)
+
+    def test_only_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate(PRIMARY_DB, 'recipes'))
+        for alias in REPLICAS:
+            self.assertFalse(self.router.allow_migrate(alias, 'recipes'))
+
+    def test_relations_within_the_pool(self):
+        primary, replica = Recipe(), Recipe()
+        primary._state.db, replica._state.db = PRIMARY_DB, REPLICAS[0]
+        self.assertTrue(self.router.allow_relation(primary, replica))
+        replica._state.db = 'other'
+        self.assertIsNone(self.router.allow_relation(primary, replica))
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS, REPLICA_PIN_SECONDS=5)
+class ReplicaPinningMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.pinned = []
+
+    def get_response(self, status=200):
+        def get_response(request):
+            self.pinned.append(is_pinned())
+            return HttpResponse(status=status)
+        return get_response
+
+    def test_safe_request_reads_from_replicas(self):
+        middleware = ReplicaPinningMiddleware(self.get_response())
+        response = middleware(self.factory.get('/api/recipes/'))
+        self.assertEqual(self.pinned, [False])
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+    def test_write_is_pinned_and_pins_the_client(self):
+        middleware = ReplicaPinningMiddleware(self.get_response(201))
+        response = middleware(self.factory.post('/api/recipes/'))
+        self.assertEqual(self.pinned, [True])
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertFalse(is_pinned())
+
+        request = self.factory.get('/api/recipes/')
+        request.COOKIES[PIN_COOKIE_NAME] = (
+            response.cookies[PIN_COOKIE_NAME].value)
+        ReplicaPinningMiddleware(self.get_response())(request)
+        self.assertEqual(self.pinned, [True, True])
+
+    def test_failed_write_does_not_pin_the_client(self):
+        middleware = ReplicaPinningMiddleware(self.get_response(400))
+        response = middleware(self.factory.post('/api/recipes/'))
+        self.assertEqual(self.pinned, [True])
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+    def test_expired_or_forged_pin_is_ignored(self):
+        middleware = ReplicaPinningMiddleware(self.get_response())
+        request = self.factory.get('/api/recipes/')
+        request.COOKIES[PIN_COOKIE_NAME] = '9999999999'
+        middleware(request)
+        with override_settings(REPLICA_PIN_SECONDS=-1):
+            response = ReplicaPinningMiddleware(self.get_response(201))(
+                self.factory.post('/api/recipes/'))
+        request = self.factory.get('/api/recipes/')
+        request.COOKIES[PIN_COOKIE_NAME] = (
+            response.cookies[PIN_COOKIE_NAME].value)
+        middleware(request)
+        self.assertEqual(self.pinned, [False, True, False])
+
+    def test_async_write_is_pinned(self):
+        async def get_response(request):
+            self.pinned.append(is_pinned())
+            return HttpResponse(status=201)
+
+        middleware = ReplicaPinningMiddleware(get_response)
+        response = async_to_sync(middleware)(
+            self.factory.post('/api/recipes/'))
+        self.assertEqual(self.pinned, [True])
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+
+@override_settings(CACHE_LEASE_WAIT=5)
+class CachedTests(SimpleTestCase):
+    """``cached`` with many threads asking for the same key at once."""
+
+    callers = 8
+
+    def setUp(self):
+        cache.clear()
+        self.computed = 0
+        self.release = threading.Event()
+
+    def compute(self):
+        self.computed += 1
+        self.release.wait(5)
+        return 'new'
+
+    def start_callers(self):
+        barrier = threading.Barrier(self.callers)
+        results = {}
+
+        def call(number):
+            barrier.wait()
+            results[number] = cached('key', self.compute, 60, mock.Mock())
+
+        threads = [threading.Thread(target=call, args=(number,))
+                   for number in range(self.callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_cold_key_is_computed_once(self):
+        threads, results = self.start_callers()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(set(results.values()), {'new'})
+
+    def test_expired_key_serves_stale_while_one_refreshes(self):
+        cache.set('key', ('old', time.time() - 1, 0), 60)
+        threads, results = self.start_callers()
+        for thread in threads:
+            thread.join(0.5)
+        # Everyone but the lease holder got the stale value right away.
+        self.assertEqual(list(results.values()), ['old'] * (self.callers - 1))
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(sorted(results.values()),
+                         ['new'] + ['old'] * (self.callers - 1))
+        self.assertEqual(cached('key', self.compute, 60, mock.Mock()), 'new')
+
+    def test_costly_key_is_refreshed_before_expiry(self):
+        self.release.set()
+        with mock.patch.object(cache_module.random, 'random',
+                               return_value=0.5):
+            # Computing took 10s and 1s is left: refresh now.
+            cache.set('key', ('old', time.time() + 1, 10), 60)
+            stats = mock.Mock()
+            self.assertEqual(cached('key', self.compute, 60, stats), 'new')
+            stats.miss.assert_called_once_with()
+            # A cheap key with as much time left is served as is.
+            cache.set('key', ('old', time.time() + 1, 0.001), 60)
+            self.assertEqual(cached('key', self.compute, 60, stats), 'old')
+            stats.hit.assert_called_once_with()
+
+    @override_settings(CACHE_LEASE_WAIT=0.1)
+    def test_waiter_computes_when_lease_holder_is_gone(self):
+        self.release.set()
+        cache.add('lease:key', 1)
+        self.assertEqual(cached('key', self.compute, 60, mock.Mock()), 'new')
+        self.assertEqual(self.computed, 1)
+        # The lease belongs to the other caller: it is left alone.
+        self.assertEqual(cache.get('lease:key'), 1)
+
+
+class WarmupTests(SimpleTestCase):
+
+    def test_failing_serializer_does_not_stop_the_rest(self):
+        with mock.patch.object(CustomUserCreateSerializer, 'get_fields',
+                               side_effect=RuntimeError), \
+                mock.patch.object(TagSerializer, 'get_fields',
+                                  autospec=True,
+                                  side_effect=ModelSerializer.get_fields
+                                  ) as tag_fields, \
+                self.assertLogs(warmup.logger) as logs:
+            warmup.compile_serializers()
+        self.assertTrue(tag_fields.called)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('CustomUserCreateSerializer', logs.output[0])
+
+    def test_failing_url_does_not_stop_the_rest(self):
+        with mock.patch.object(warmup, 'fetch',
+                               side_effect=[RuntimeError, 500]) as fetch, \
+                self.assertLogs(warmup.logger) as logs:
+            warmup.prime_read_caches()
+        self.assertEqual(fetch.call_count, len(warmup.PRIMED_URLS))
+        self.assertIn(warmup.PRIMED_URLS[0], logs.output[0])
+        self.assertIn(warmup.PRIMED_URLS[1], logs.output[1])
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = b'{"name": "\xd0\xbc\xd1\x83\xd0\xba\xd0\xb0"}' * 20
+
+    def setUp(self):
+        cache.clear()
+
+    def respond(self, response, accept='gzip, br'):
+        request = RequestFactory().get('/api/tags/',
+                                       HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def json(self, body=None, **headers):
+        response = HttpResponse(self.body if body is None else body,
+                                content_type='application/json')
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def test_negotiation(self):
+        for accept, coding in (('gzip, br', 'br'),
+                               ('gzip, br;q=0', 'gzip'),
+                               ('*', 'br'),
+                               ('*, br;q=0', 'gzip'),
+                               ('identity', None),
+                               ('gzip;q=0', None),
+                               ('', None)):
+            with self.subTest(accept=accept):
+                response = self.respond(self.json(), accept)
+                self.assertEqual(response.get('Content-Encoding'), coding)
+        with mock.patch.object(compression, 'brotli', None):
+            response = self.respond(self.json(), 'br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertEqual(response['Content-Length'],
+                         str(len(response.content)))
+
+    def test_small_or_binary_bodies_are_left_alone(self):
+        for response in (self.json(self.body[:99]),
+                         HttpResponse(self.body, content_type='image/png')):
+            response = self.respond(response)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertNotIn('Vary', response)
+
+    def test_vary_even_when_not_compressed(self):
+        response = self.respond(self.json(), accept='')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.content, self.body)
+
+    def test_etag_becomes_weak(self):
+        for etag in ('"abc"', 'W/"abc"'):
+            with self.subTest(etag=etag):
+                response = self.respond(self.json(ETag=etag))
+                self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_not_modified_is_left_alone(self):
+        response = HttpResponse(status=304, content_type='application/json')
+        response['ETag'] = '"abc"'
+        response = self.respond(response)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['ETag'], '"abc"')
+
+    def test_cached_body_is_compressed_once(self):
+        with mock.patch.object(compression, 'compress',
+                               wraps=compression.compress) as compress:
+            first = self.respond(cache_compressed(self.json()), 'gzip')
+            second = self.respond(cache_compressed(self.json()), 'gzip')
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(gzip.decompress(second.content), self.body)
+
+    def test_streamed_body(self):
+        chunks = [b'line %d\n' % number for number in range(50)]
+        response = self.respond(
+            StreamingHttpResponse(iter(chunks), content_type='text/plain'),
+            'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response)
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            b''.join(chunks))
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        Ingredient.objects.bulk_create([
+            Ingredient(name='мука', measurement_unit='г'),
+            Ingredient(name='молоко', measurement_unit='мл')])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def postgres(self, estimate):
+        """Makes the paginator see PostgreSQL with ``estimate`` rows."""
+        connection = mock.MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (estimate,)
+        connections = mock.MagicMock()
+        connections.__getitem__.return_value = connection
+        patch = mock.patch.object(paginators, 'connections', connections)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return connection
+
+    def result_count(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'].result_count
+
+    def test_unfiltered_changelist_uses_the_estimate(self):
+        connection = self.postgres(500_000)
+        self.assertEqual(self.result_count('/admin/users/user/'), 500_000)
+        self.assertEqual(self.result_count('/admin/recipes/ingredient/'),
+                         500_000)
+        self.assertEqual(connection.cursor.call_count, 2)
+
+    def test_filtered_changelist_counts_exactly(self):
+        connection = self.postgres(500_000)
+        self.assertEqual(self.result_count('/admin/users/user/?q=adm'), 1)
+        self.assertEqual(self.result_count(
+            '/admin/recipes/ingredient/?measurement_unit=%D0%B3'), 1)
+        connection.cursor.assert_not_called()
+
+    def test_small_table_counts_exactly(self):
+        self.postgres(paginators.EXACT_COUNT_LIMIT - 1)
+        self.assertEqual(self.result_count('/admin/recipes/ingredient/'), 2)
+
+    def test_other_databases_count_exactly(self):
+        self.assertEqual(self.result_count('/admin/recipes/ingredient/'), 2)
@@ -0,0 +1,100 @@
+"""
+Warmup run by the production server before it accepts traffic.
+
+Imports every view through the URLconf, builds the fields of all API
+serializers, loads the tag and ingredient registry and serves the tag and
+ingredient lists once, so the first real requests don't pay for lazy
+imports and cold caches. With a preloaded
+app this runs once in the gunicorn master and is shared by the forked
+workers (see ``gunicorn.conf.py``).
+
+Failures are logged per serializer and per URL and the rest is still
+warmed: a cold start is slower, not broken.
+"""
+import inspect
+import logging
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import get_resolver, resolve, reverse
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+PRIMED_URLS = ('api:tags-list', 'api:ingredients-list')
+
+
+def import_urlconf():
+    get_resolver().url_patterns
+
+
+def compile_serializers():
+    from api import serializers
+
+    for name, serializer_class in inspect.getmembers(serializers,
+                                                     inspect.isclass):
+        if not issubclass(serializer_class, BaseSerializer):
+            continue
+        if serializer_class.__module__ != serializers.__name__:
+            continue
+        try:
+            serializer_class().fields
+        except Exception:
+            logger.exception('Warmup could not build serializer %s', name)
+
+
+def served_host():
+    """A host the site answers to: absolute URLs are built from it."""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def fetch(path, query=None):
+    """Serves an anonymous GET of ``path`` in-process; returns the status."""
+    match = resolve(path)
+    view = match.func
+    if iscoroutinefunction(view):
+        view = async_to_sync(view)
+    request = RequestFactory().get(path, query, HTTP_HOST=served_host())
+    response = view(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response.status_code
+
+
+def load_reference_data():
+    from recipes.reference import registry
+
+    registry.get()
+
+
+def prime_read_caches():
+    for name in PRIMED_URLS:
+        try:
+            status = fetch(reverse(name))
+        except Exception:
+            logger.exception('Warmup could not fetch %s', name)
+            continue
+        if status != 200:
+            logger.warning('Warmup got status %s from %s', status, name)
+
+
+def warmup():
+    """Runs every step and returns how long each took, in seconds."""
+    timings = {}
+    for step in (import_urlconf, compile_serializers, load_reference_data,
+                 prime_read_caches):
+        started = time.monotonic()
+        try:
+            step()
+        except Exception:
+            logger.exception('Warmup step %s failed', step.__name__)
+        timings[step.__name__] = time.monotonic() - started
+    # Forked workers must not share the master's database sockets.
+    connections.close_all()
+    return timings
@@ -0,0 +1,99 @@
+"""
+Gunicorn settings of the backend container, tuned through the environment.
+
+GUNICORN_WORKER_CLASS  sync (default), gthread or uvicorn (ASGI, serves
+                       foodgram_backend.asgi, see ASYNC_READ_VIEWS)
+GUNICORN_WORKERS       worker count, by default derived from the CPUs
+GUNICORN_MAX_WORKERS   upper bound of the derived count (16)
+GUNICORN_THREADS       threads per gthread worker (4)
+GUNICORN_PRELOAD       load the app in the master and share it (true)
+GUNICORN_WARMUP        run foodgram_backend.warmup before serving (true)
+GUNICORN_TIMEOUT       worker timeout in seconds (30)
+GUNICORN_MAX_REQUESTS  recycle a worker after this many requests (1000)
+
+The worker count can still be changed at runtime with TTIN/TTOU signals.
+More than one worker needs REDIS_URL: cache generations, leases and stats
+have to be shared by the workers, so startup fails without it.
+"""
+import os
+import time
+
+STARTED_AT = time.monotonic()
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+
+def env_flag(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def cpu_count():
+    # Honours CPU pinning of the container, unlike os.cpu_count().
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(kind):
+    # Sync workers block on I/O; threaded and async ones do not.
+    workers = 2 * cpu_count() + 1 if kind == 'sync' else cpu_count() + 1
+    return min(workers, int(os.getenv('GUNICORN_MAX_WORKERS', 16)))
+
+
+worker_kind = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_class = WORKER_CLASSES[worker_kind]
+wsgi_app = ('foodgram_backend.asgi:application' if worker_kind == 'uvicorn'
+            else 'foodgram_backend.wsgi:application')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 0)) or default_workers(
+    worker_kind)
+# More than one thread silently turns sync workers into gthread ones.
+threads = int(os.getenv('GUNICORN_THREADS',
+                        4 if worker_kind == 'gthread' else 1))
+preload_app = env_flag('GUNICORN_PRELOAD', True)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+warmup_enabled = env_flag('GUNICORN_WARMUP', True)
+
+
+def run_warmup(log):
+    from foodgram_backend.warmup import warmup
+
+    timings = warmup()
+    log.info('Warmup took %.2fs (%s)', sum(timings.values()), ', '.join(
+        f'{step} {seconds:.2f}s' for step, seconds in timings.items()))
+
+
+def on_starting(server):
+    # With a per-process cache a write only invalidates the writing worker.
+    if workers > 1 and not os.getenv('REDIS_URL'):
+        raise RuntimeError(
+            f'{workers} workers need a shared cache: set REDIS_URL '
+            'or GUNICORN_WORKERS=1')
+
+
+def when_ready(server):
+    if preload_app and warmup_enabled:
+        run_warmup(server.log)
+    server.log.info('Master ready in %.2fs, starting %s %s workers',
+                    time.monotonic() - STARTED_AT, workers, worker_kind)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    if not preload_app and warmup_enabled:
+        run_warmup(worker.log)
+    worker.log.info('Worker %s ready in %.2fs', worker.pid,
+                    time.monotonic() - worker.forked_at)
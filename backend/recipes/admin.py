@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from foodgram_backend.paginators import EstimatedCountPaginator
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
@@ -10,46 +13,79 @@ from recipes.models import (
 )
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug')
     list_filter = ('name', 'color')
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('^name',)
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author_name')
-    list_filter = ('author__username', 'name', 'tags__name')
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ('name', 'author_name', 'favorites_count')
+    list_filter = ('tags__name',)
+    list_select_related = ('author',)
+    search_fields = ('name', '^author__username')
+    raw_id_fields = ('author',)
+    autocomplete_fields = ('tags',)
 
+    def get_queryset(self, request):
+        favorites = FavoriteRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(count=Count('*')).values('count')
+        return super().get_queryset(request).annotate(
+            favorites_count=Coalesce(
+                Subquery(favorites, output_field=IntegerField()), 0))
+
+    @admin.display(description='Автор', ordering='author__username')
     def author_name(self, obj):
         return obj.author.username
 
+    @admin.display(description='В избранном', ordering='favorites_count')
+    def favorites_count(self, obj):
+        return obj.favorites_count
+
 
 @admin.register(FavoriteRecipe)
-class FavoriteRecipeAdmin(admin.ModelAdmin):
+class FavoriteRecipeAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe')
-    list_filter = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    search_fields = ('^user__username', '^recipe__name')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(RecipeShoppingList)
-class RecipeShoppingListAdmin(admin.ModelAdmin):
+class RecipeShoppingListAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe', 'date_added')
-    list_filter = ('user', 'recipe', 'date_added')
+    list_filter = ('date_added',)
+    list_select_related = ('user', 'recipe')
+    search_fields = ('^user__username', '^recipe__name')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(LargeTableAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
-    list_filter = ('recipe', 'ingredient')
+    list_select_related = ('recipe', 'ingredient')
+    search_fields = ('^recipe__name', '^ingredient__name')
+    autocomplete_fields = ('recipe', 'ingredient')
 
 
 @admin.register(RecipeTag)
-class RecipeTagAdmin(admin.ModelAdmin):
+class RecipeTagAdmin(LargeTableAdmin):
     list_display = ('recipe', 'tag')
-    list_filter = ('recipe', 'tag')
+    list_filter = ('tag',)
+    list_select_related = ('recipe', 'tag')
+    autocomplete_fields = ('recipe', 'tag')
@@ -0,0 +1,95 @@
+"""
+Change log behind the /api/sync/ delta endpoint.
+
+Every write to recipes, favorites, cart entries and follows appends a
+``ChangeLogEntry`` from a model signal; deletions append tombstones. The
+entry id is the client's cursor, so ids must not become visible out of
+order: a transaction holding id N that commits after N+1 was served would
+be skipped for good. Entries are therefore written once the write has
+committed (``transaction.on_commit``), each in its own short insert, and
+``changes_since`` holds back entries younger than a safety lag, which
+covers the instant between such an insert taking its id and committing.
+
+``compact`` keeps the log bounded: only the newest entry per object is
+needed to bring a client up to date, and tombstones older than the
+retention period are dropped. Clients whose cursor predates dropped
+tombstones are told to resync from scratch.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+from .models import ChangeLogCompaction, ChangeLogEntry
+
+
+def record(kind, target_id, user_id=None, deleted=False):
+    transaction.on_commit(lambda: ChangeLogEntry.objects.create(
+        kind=kind, target_id=target_id, user_id=user_id, deleted=deleted))
+
+
+def horizon():
+    """Cursors below this may have missed deletions."""
+    return ChangeLogCompaction.objects.order_by('-id').values_list(
+        'horizon', flat=True).first() or 0
+
+
+def latest_cursor():
+    # Entries are written after their change committed, so a client that
+    # loads everything after reading this has seen every change up to it.
+    # The newest entries may be compacted tombstones: never below horizon.
+    cursor = ChangeLogEntry.objects.aggregate(cursor=Max('id'))['cursor']
+    return max(cursor or 0, horizon())
+
+
+def changes_since(cursor, user, limit, lag):
+    """
+    Net changes visible to ``user`` after ``cursor``: ``(changes, cursor,
+    has_more)`` where changes maps ``(kind, target_id)`` to whether the
+    newest entry in the window is a tombstone. Stops before the first entry
+    younger than ``lag`` seconds: a smaller id may still be committing.
+    """
+    entries = list(
+        ChangeLogEntry.objects.filter(
+            Q(user=user) | Q(user__isnull=True), id__gt=cursor
+        ).order_by('id').values_list(
+            'id', 'kind', 'target_id', 'deleted', 'created')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    settled = timezone.now() - timedelta(seconds=lag)
+    for position, (*_, created) in enumerate(entries):
+        if created > settled:
+            entries, has_more = entries[:position], False
+            break
+    changes = {}
+    for _, kind, target_id, deleted, _ in entries:
+        changes[kind, target_id] = deleted
+    return changes, entries[-1][0] if entries else cursor, has_more
+
+
+def superseded():
+    """Entries with a newer entry for the same object."""
+    newer = ChangeLogEntry.objects.filter(
+        kind=OuterRef('kind'), target_id=OuterRef('target_id'),
+        id__gt=OuterRef('id'))
+    shared = Q(Exists(newer.filter(user__isnull=True)), user__isnull=True)
+    personal = Q(Exists(newer.filter(user=OuterRef('user'))),
+                 user__isnull=False)
+    return ChangeLogEntry.objects.filter(shared | personal)
+
+
+def compact(tombstone_days):
+    """Returns how many superseded entries and tombstones were removed."""
+    with transaction.atomic():
+        removed, _ = superseded().delete()
+        expired = ChangeLogEntry.objects.filter(
+            deleted=True,
+            created__lt=timezone.now() - timedelta(days=tombstone_days))
+        expired_horizon = expired.aggregate(horizon=Max('id'))['horizon']
+        if expired_horizon is None:
+            return removed, 0
+        dropped, _ = expired.delete()
+        latest = ChangeLogCompaction.objects.create(
+            horizon=max(expired_horizon, horizon()))
+        ChangeLogCompaction.objects.exclude(pk=latest.pk).delete()
+    return removed, dropped
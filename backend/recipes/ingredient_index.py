@@ -0,0 +1,107 @@
+"""
+Inverted index ingredient -> recipes for "what can I cook" ranking.
+
+Each ``IngredientRecipes`` row holds the sorted ids of the recipes using the
+ingredient as a packed uint32 array and, aligned with it, how many
+ingredients each of those recipes has (``Recipe.ingredients_count``).
+``RecipeIngredient`` writes refresh it after commit (``recipes/signals.py``).
+Ranking recipes for a set of ingredients is then a concatenation and
+``np.unique`` over a few arrays, without reading the recipes. Writes refresh
+only the ingredients they touched, which are all the rows listing the
+recipes whose counts changed.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Ingredient, IngredientRecipes, Recipe, RecipeIngredient
+
+DTYPE = np.uint32
+COUNT_DTYPE = np.uint16
+REBUILD_BATCH_SIZE = 200
+
+
+def unpack(data, dtype=DTYPE):
+    return np.frombuffer(data, dtype=dtype)
+
+
+def refresh_ingredients(ingredient_ids):
+    """Recomputes the index rows of ``ingredient_ids`` from the database."""
+    ingredient_ids = sorted(set(ingredient_ids))
+    if not ingredient_ids:
+        return
+    with transaction.atomic():
+        # Serializes concurrent refreshes of the same ingredients, so the
+        # last one to write has read the latest committed recipes.
+        list(IngredientRecipes.objects.select_for_update().filter(
+            ingredient_id__in=ingredient_ids).values_list('pk'))
+        uses = np.array(
+            RecipeIngredient.objects.filter(
+                ingredient_id__in=ingredient_ids
+            ).order_by('ingredient_id', 'recipe_id').values_list(
+                'ingredient_id', 'recipe_id',
+                'recipe__ingredients_count').distinct(),
+            dtype=np.int64).reshape(-1, 3)
+        bounds = np.searchsorted(uses[:, 0], ingredient_ids, side='left')
+        ends = np.searchsorted(uses[:, 0], ingredient_ids, side='right')
+        IngredientRecipes.objects.bulk_create(
+            [IngredientRecipes(
+                ingredient_id=ingredient_id,
+                recipe_ids=uses[start:end, 1].astype(DTYPE).tobytes(),
+                recipe_counts=uses[start:end, 2].astype(
+                    COUNT_DTYPE).tobytes())
+             for ingredient_id, start, end
+             in zip(ingredient_ids, bounds, ends)],
+            update_conflicts=True,
+            unique_fields=['ingredient'],
+            update_fields=['recipe_ids', 'recipe_counts'],
+        )
+
+
+def refresh_recipe_counts(recipes):
+    counts = RecipeIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).values('recipe').annotate(count=Count('*')).values('count')
+    recipes.update(ingredients_count=Coalesce(Subquery(counts), 0))
+
+
+def refresh(recipe_ids, ingredient_ids):
+    """
+    Brings the index up to date after the recipes' ingredients changed;
+    ``ingredient_ids`` are all their old and new ingredients.
+    """
+    refresh_recipe_counts(Recipe.objects.filter(id__in=recipe_ids))
+    refresh_ingredients(ingredient_ids)
+
+
+def rebuild():
+    refresh_recipe_counts(Recipe.objects.all())
+    ingredient_ids = list(
+        Ingredient.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ingredient_ids), REBUILD_BATCH_SIZE):
+        refresh_ingredients(
+            ingredient_ids[start:start + REBUILD_BATCH_SIZE])
+
+
+def rank(have_ids, limit):
+    """
+    Ids of recipes sharing ingredients with ``have_ids``, best coverage
+    (share of the recipe's ingredients already at hand) first. A recipe
+    deleted a moment ago may still be listed: callers filter the ids
+    through a queryset anyway.
+    """
+    rows = list(IngredientRecipes.objects.filter(
+        ingredient_id__in=set(have_ids)).values_list('recipe_ids',
+                                                     'recipe_counts'))
+    if not rows:
+        return []
+    recipe_ids, first, matched = np.unique(
+        np.concatenate([unpack(ids) for ids, _ in rows]),
+        return_index=True, return_counts=True)
+    totals = np.concatenate([unpack(counts, COUNT_DTYPE)
+                             for _, counts in rows])[first]
+    # Rows refreshed at different moments may disagree for an instant.
+    coverage = matched / np.maximum(totals, matched)
+    # Best coverage, then more matched ingredients, then newest.
+    order = np.lexsort((-recipe_ids.astype(np.int64), -matched, -coverage))
+    return recipe_ids[order[:limit]].tolist()
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+from recipes import ingredient_index
+
+
+class Command(BaseCommand):
+    help = ('Полностью перестраивает индекс ингредиент -> рецепты '
+            'для поиска рецептов по имеющимся продуктам.')
+
+    def handle(self, *args, **options):
+        ingredient_index.rebuild()
+        self.stdout.write(self.style.SUCCESS('Индекс ингредиентов построен'))
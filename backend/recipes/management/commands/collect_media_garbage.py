@@ -0,0 +1,41 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов, на которые не ссылается ни один '
+            'рецепт (в том числе загруженные, но так и не прикреплённые).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=int, default=24,
+            help='Не трогать файлы моложе этого возраста')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        field = Recipe.image.field
+        storage = field.storage
+        directory = field.upload_to.rstrip('/')
+        referenced = set(
+            Recipe.objects.exclude(image='').values_list(
+                'image', flat=True).iterator())
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+
+        removed = kept = 0
+        _, files = storage.listdir(directory)
+        for filename in files:
+            name = posixpath.join(directory, filename)
+            if name in referenced:
+                kept += 1
+                continue
+            if storage.get_modified_time(name) > cutoff:
+                continue
+            if not options['dry_run']:
+                storage.delete(name)
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {removed}, используется: {kept}'))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes import changelog
+
+
+class Command(BaseCommand):
+    help = ('Сжимает журнал изменений для /api/sync/: оставляет последнюю '
+            'запись по каждому объекту и удаляет старые записи об удалении.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tombstone-days', type=int,
+            default=settings.SYNC_TOMBSTONE_DAYS,
+            help='Сколько дней хранить записи об удалении.')
+
+    def handle(self, *args, **options):
+        removed, dropped = changelog.compact(options['tombstone_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено устаревших записей: {removed}, '
+            f'записей об удалении: {dropped}'))
@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+from recipes import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рекомендации рецептов для пользователей '
+            'по избранному и спискам покупок.')
+
+    def handle(self, *args, **options):
+        personalised = recommendations.recompute()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рекомендации пересчитаны, персональные: {personalised}'))
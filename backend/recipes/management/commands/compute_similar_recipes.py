@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+from recipes import similarity
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицу похожих рецептов для рецептов, '
+            'изменившихся с прошлого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты, а не только изменившиеся.')
+
+    def handle(self, *args, **options):
+        updated = similarity.recompute(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны: {updated}'))
@@ -2,7 +2,9 @@ import csv
 from typing import Any
 from django.core.management import BaseCommand
 from django.conf import settings
+from foodgram_backend.cache import bump_generation
 from recipes.models import Ingredient
+from recipes.units import to_base
 
 
 class Command(BaseCommand):
@@ -10,6 +12,11 @@ class Command(BaseCommand):
         with open(f"{settings.BASE_DIR}/data/ingredients.csv",
                   encoding="utf-8") as source:
             reader = csv.reader(source)
-            ingredients = [Ingredient(id, *data)
-                           for id, data in enumerate(reader, start=1)]
+            ingredients = []
+            for id, (name, unit) in enumerate(reader, start=1):
+                base_unit, unit_factor = to_base(unit)
+                ingredients.append(Ingredient(
+                    id=id, name=name, measurement_unit=unit,
+                    base_unit=base_unit, unit_factor=unit_factor))
             Ingredient.objects.bulk_create(ingredients, ignore_conflicts=True)
+        bump_generation('ingredients')
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes import nutrition
+
+
+class Command(BaseCommand):
+    help = ('Загружает калорийность, БЖУ и цену ингредиентов (на единицу '
+            'измерения) и пересчитывает итоги всех рецептов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=f'{settings.BASE_DIR}/data/ingredient_facts.csv',
+            help='CSV с колонками name, kcal, protein, fat, carbs, price.')
+
+    def handle(self, *args, **options):
+        updated = nutrition.load_facts(options['path'])
+        nutrition.backfill()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено ингредиентов: {updated}, итоги рецептов пересчитаны'))
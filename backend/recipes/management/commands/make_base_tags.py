@@ -1,6 +1,7 @@
 import random
 from django.core.management import BaseCommand
 from django.utils.text import slugify
+from foodgram_backend.cache import bump_generation
 from recipes.models import Tag
 
 
@@ -19,6 +20,7 @@ class Command(BaseCommand):
         ]
         tags = [Tag(**data) for data in tags_data]
         Tag.objects.bulk_create(tags, ignore_conflicts=True)
+        bump_generation('tags')
 
     @staticmethod
     def generate_random_color():
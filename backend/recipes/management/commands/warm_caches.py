@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import combinations
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.db.models.functions import Substr
+from django.urls import reverse
+from foodgram_backend.cache import is_shared
+from foodgram_backend.warmup import fetch
+from recipes.models import Ingredient, Recipe, Tag
+
+# Up to this many tags every combination of them is warmed; with more, only
+# no tags, each tag alone and all of them (what the frontend starts with).
+ALL_COMBINATIONS_UP_TO = 4
+
+
+class Command(BaseCommand):
+    help = ('Заполняет кэши после деплоя: теги, поиск ингредиентов, первые '
+            'страницы анонимной ленты по сочетаниям тегов и популярные '
+            'рецепты. Запросы идут параллельно и укладываются в бюджет '
+            'времени. Нужен общий кэш (REDIS_URL): кэш в памяти процесса '
+            'команды воркерам не виден.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages', type=int, default=3,
+            help='Сколько первых страниц ленты прогреть для каждого '
+                 'сочетания тегов.')
+        parser.add_argument(
+            '--recipes', type=int, default=50,
+            help='Сколько самых популярных рецептов запросить.')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число потоков.')
+        parser.add_argument(
+            '--budget', type=float, default=60,
+            help='Бюджет времени в секундах: что не успели — пропускается.')
+
+    def handle(self, *args, **options):
+        if not is_shared():
+            raise CommandError(
+                'Кэш локальный для процесса (нет REDIS_URL): прогревать '
+                'нечего, воркеры его не увидят.')
+        started = time.monotonic()
+        deadline = started + options['budget']
+        tasks = list(self.tasks(options))
+        warmed = {kind: 0 for kind, _, _ in tasks}
+        failed = skipped = 0
+
+        def run(path, query):
+            if time.monotonic() > deadline:
+                return None
+            try:
+                return fetch(path, query)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(options['workers']) as executor:
+            pending = {executor.submit(run, path, query): kind
+                       for kind, path, query in tasks}
+            while pending:
+                done, _ = wait(pending, deadline - time.monotonic(),
+                               return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    kind = pending.pop(future)
+                    if future.exception() is not None:
+                        failed += 1
+                    elif future.result() is None:
+                        skipped += 1
+                    elif future.result() == 200:
+                        warmed[kind] += 1
+            for future in pending:
+                future.cancel()
+            skipped += len(pending)
+
+        summary = ', '.join(f'{kind}: {count}'
+                            for kind, count in warmed.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето за {time.monotonic() - started:.1f} с — {summary}; '
+            f'ошибок: {failed}, не успели: {skipped}'))
+
+    def tasks(self, options):
+        """``(kind, path, query)`` of every request to make, cheapest first."""
+        yield 'теги', reverse('api:tags-list'), None
+        ingredients = reverse('api:ingredients-list')
+        yield 'ингредиенты', ingredients, None
+        letters = Ingredient.objects.annotate(
+            letter=Substr('name', 1, 1)).values_list(
+            'letter', flat=True).distinct()
+        for letter in sorted(set(letter.lower() for letter in letters)):
+            yield 'ингредиенты', ingredients, {'name': letter}
+
+        recipes = reverse('api:recipes-list')
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        for tags in self.tag_combinations():
+            for page in range(1, options['pages'] + 1):
+                yield 'страницы ленты', recipes, {
+                    'tags': tags, 'page': page, 'limit': page_size}
+
+        popular = Recipe.objects.annotate(
+            popularity=Count('favoriterecipe')).order_by(
+            '-popularity', '-id').values_list('id', flat=True)
+        for recipe_id in popular[:options['recipes']]:
+            yield 'рецепты', reverse('api:recipes-detail',
+                                     args=[recipe_id]), None
+
+    def tag_combinations(self):
+        slugs = list(Tag.objects.order_by('id').values_list('slug',
+                                                            flat=True))
+        if len(slugs) <= ALL_COMBINATIONS_UP_TO:
+            for size in range(len(slugs) + 1):
+                yield from (list(tags) for tags in combinations(slugs, size))
+            return
+        yield []
+        yield from ([slug] for slug in slugs)
+        yield slugs
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:38
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0003_rename_unit_ingredient_measurement_unit_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ('-id',)},
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Время не может быть менее 1 минуты'), django.core.validators.MaxValueValidator(480, message='Время не может быть более 8 часов')]),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount',
+            field=models.PositiveSmallIntegerField(),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_ordering'),
+    ]
+
+    # The auto-created M2M table only has (recipe_id, tag_id) and the
+    # single-column FK indexes; tag filtering also probes it by tag first.
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS recipes_recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id);',
+            reverse_sql='DROP INDEX IF EXISTS '
+                        'recipes_recipe_tags_tag_recipe_idx;',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientRecipes',
+            fields=[
+                ('ingredient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_index', serialize=False, to='recipes.ingredient')),
+                ('recipe_ids', models.BinaryField(default=bytes)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='similar_stale',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('similar_stale', True)), fields=['id'], name='recipes_recipe_similar_stale'),
+        ),
+        migrations.AddField(
+            model_name='similarrecipe',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_recipes', to='recipes.recipe'),
+        ),
+        migrations.AddField(
+            model_name='similarrecipe',
+            name='similar',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='similarrecipe',
+            unique_together={('recipe', 'similar')},
+        ),
+    ]
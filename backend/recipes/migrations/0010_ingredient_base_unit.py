@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:49
+
+from django.db import migrations, models
+
+# recipes/units.py as of this migration, copied so that later changes to the
+# catalogue of units don't change what this migration does.
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'капля': ('мл', 0.05),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+}
+NOT_SUMMABLE = {'по вкусу'}
+
+
+def to_base(measurement_unit):
+    if measurement_unit in NOT_SUMMABLE:
+        return measurement_unit, None
+    return UNIT_CONVERSIONS.get(measurement_unit, (measurement_unit, 1))
+
+
+def fill_base_units(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    units = Ingredient.objects.values_list(
+        'measurement_unit', flat=True).distinct()
+    for unit in list(units):
+        base_unit, unit_factor = to_base(unit)
+        Ingredient.objects.filter(measurement_unit=unit).update(
+            base_unit=base_unit, unit_factor=unit_factor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_nutrition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='base_unit',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='unit_factor',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_base_units, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_servings_decimal_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogCompaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('horizon', models.PositiveBigIntegerField()),
+                ('compacted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'Рецепт'), ('favorite', 'Избранное'), ('cart', 'Список покупок'), ('follow', 'Подписка')], max_length=16)),
+                ('target_id', models.PositiveIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'target_id', 'user'], name='recipes_changelog_key')],
+            },
+        ),
+    ]
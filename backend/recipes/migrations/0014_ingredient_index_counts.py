@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:23
+
+import numpy as np
+from django.db import migrations, models
+
+# The index packing of recipes/ingredient_index.py when this migration was
+# written, kept here so that later changes there don't alter it.
+RECIPE_ID_DTYPE = np.uint32
+COUNT_DTYPE = np.uint16
+
+
+def fill_recipe_counts(apps, schema_editor):
+    IngredientRecipes = apps.get_model('recipes', 'IngredientRecipes')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    totals = dict(Recipe.objects.values_list('id', 'ingredients_count'))
+    for row in IngredientRecipes.objects.iterator():
+        recipe_ids = np.frombuffer(row.recipe_ids, dtype=RECIPE_ID_DTYPE)
+        row.recipe_counts = np.array(
+            [totals.get(recipe_id, 0) for recipe_id in recipe_ids.tolist()],
+            dtype=COUNT_DTYPE).tobytes()
+        row.save(update_fields=['recipe_counts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientrecipes',
+            name='recipe_counts',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(fill_recipe_counts, migrations.RunPython.noop),
+    ]
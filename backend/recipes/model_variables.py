@@ -12,4 +12,6 @@ MEASURE_UNITS = (
     ('piece', 'шт'),
 )
 AMOUNT_MAX_LEN = 6
+AMOUNT_MAX_DIGITS = 10
+AMOUNT_DECIMAL_PLACES = 3
 RECIPE_MAX_LEN = 100
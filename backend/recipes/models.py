@@ -1,8 +1,14 @@
+from decimal import Decimal
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Exists, OuterRef, Q, Value
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
-from .model_variables import (TAG_NAME_LENGTH,
+from users.models import Follow
+from .model_variables import (AMOUNT_DECIMAL_PLACES,
+                              AMOUNT_MAX_DIGITS,
+                              TAG_NAME_LENGTH,
                               COLOR_LEN_STR,
                               INGREDIENT_NAME_LEN,
                               MEASURE_NAME_LEN,
@@ -22,6 +28,43 @@ class Tag(models.Model):
 class Ingredient(models.Model):
     name = models.CharField(max_length=INGREDIENT_NAME_LEN, unique=True)
     measurement_unit = models.CharField(max_length=MEASURE_NAME_LEN)
+    # Per one measurement_unit, empty when unknown (data/ingredient_facts.csv).
+    kcal = models.FloatField(null=True, blank=True)
+    protein = models.FloatField(null=True, blank=True)
+    fat = models.FloatField(null=True, blank=True)
+    carbs = models.FloatField(null=True, blank=True)
+    price = models.FloatField(null=True, blank=True)
+    # Precomputed from measurement_unit, see recipes/units.
+    base_unit = models.CharField(max_length=MEASURE_NAME_LEN, blank=True,
+                                 editable=False)
+    unit_factor = models.FloatField(null=True, editable=False)
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """
+        Annotates is_favorited, is_in_shopping_cart and author_is_subscribed
+        for ``user`` so serializers don't issue a query per recipe.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                recipe=OuterRef('pk'), user=user)),
+            is_in_shopping_cart=Exists(RecipeShoppingList.objects.filter(
+                recipe=OuterRef('pk'), user=user)),
+            author_is_subscribed=Exists(Follow.objects.filter(
+                author=OuterRef('author'), subscriber=user)),
+        )
+
+    def for_read(self):
+        return self.select_related('author').prefetch_related(
+            'tags', 'recipeingredient_set__ingredient')
 
 
 class Recipe(models.Model):
@@ -46,12 +89,83 @@ class Recipe(models.Model):
             MaxValueValidator(
                 480,
                 message="Время не может быть более 8 часов")])
+    servings = models.PositiveSmallIntegerField(
+        default=1,
+        validators=[
+            MinValueValidator(
+                1,
+                message="Рецепт должен быть хотя бы на одну порцию")])
+
+    ingredients_count = models.PositiveSmallIntegerField(default=0,
+                                                         editable=False)
+    similar_stale = models.BooleanField(default=True, editable=False)
+    # Totals over the ingredients with known facts, see recipes/nutrition.
+    kcal = models.FloatField(default=0, editable=False)
+    protein = models.FloatField(default=0, editable=False)
+    fat = models.FloatField(default=0, editable=False)
+    carbs = models.FloatField(default=0, editable=False)
+    price = models.FloatField(default=0, editable=False)
+    # Also touched by changes to the tags and ingredients, see signals.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['id'], condition=Q(similar_stale=True),
+                         name='recipes_recipe_similar_stale'),
+        ]
 
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
-    amount = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(
+        max_digits=AMOUNT_MAX_DIGITS,
+        decimal_places=AMOUNT_DECIMAL_PLACES,
+        validators=[MinValueValidator(Decimal('0.001'))])
+
+
+class IngredientRecipes(models.Model):
+    """
+    Inverted index row: sorted ids of recipes using the ingredient and,
+    aligned with them, each recipe's ``ingredients_count``.
+    """
+    ingredient = models.OneToOneField(Ingredient, on_delete=models.CASCADE,
+                                      primary_key=True,
+                                      related_name='recipe_index')
+    recipe_ids = models.BinaryField(default=bytes)
+    recipe_counts = models.BinaryField(default=bytes)
+
+
+class SimilarRecipe(models.Model):
+    """Precomputed nearest neighbour of a recipe, see recipes/similarity."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='similar_recipes')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                                related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ['recipe', 'similar']
+
+
+class RecommendedRecipe(models.Model):
+    """
+    Precomputed recommendation for a user, see recipes/recommendations;
+    rows without a user are the popularity fallback.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE,
+                             null=True,
+                             related_name='recommendations')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='recommended_for')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ['user', 'recipe']
 
 
 class RecipeTag(models.Model):
@@ -64,6 +178,9 @@ class RecipeShoppingList(models.Model):
                              on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     date_added = models.DateTimeField(auto_now_add=True)
+    # Portions to buy for; empty means the recipe's own servings.
+    servings = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)])
 
     class Meta:
         unique_together = ['user', 'recipe']
@@ -76,3 +193,45 @@ class FavoriteRecipe(models.Model):
 
     class Meta:
         unique_together = ['user', 'recipe']
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only log of what /api/sync/ reports, see recipes/changelog.
+    Favorites, cart entries and follows belong to ``user``; recipe entries
+    have no user. ``target_id`` is the recipe, or the author for follows.
+    """
+    RECIPE = 'recipe'
+    FAVORITE = 'favorite'
+    CART = 'cart'
+    FOLLOW = 'follow'
+    KINDS = (
+        (RECIPE, 'Рецепт'),
+        (FAVORITE, 'Избранное'),
+        (CART, 'Список покупок'),
+        (FOLLOW, 'Подписка'),
+    )
+
+    kind = models.CharField(max_length=16, choices=KINDS)
+    # No constraint: deleting a user logs tombstones for its favorites
+    # while the user row itself goes away in the same transaction.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.DO_NOTHING,
+                             db_constraint=False,
+                             null=True,
+                             related_name='+')
+    target_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'target_id', 'user'],
+                         name='recipes_changelog_key'),
+        ]
+
+
+class ChangeLogCompaction(models.Model):
+    """Entries up to ``horizon`` may have lost their tombstones."""
+    horizon = models.PositiveBigIntegerField()
+    compacted_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,85 @@
+"""
+Nutrition and cost totals of recipes.
+
+``Ingredient`` holds kcal, protein, fat, carbs and price per one
+measurement unit (loaded by ``import_ingredient_facts``); ``Recipe`` keeps
+the sums over its ingredients. Totals are computed for a whole batch of
+recipes at once: the amounts are multiplied by a facts matrix and summed
+per recipe with NumPy, no per-recipe queries. ``RecipeIngredient`` writes
+refresh the totals of their recipes after commit (``recipes/signals.py``).
+"""
+import csv
+
+import numpy as np
+from .models import Ingredient, Recipe, RecipeIngredient
+
+FIELDS = ('kcal', 'protein', 'fat', 'carbs', 'price')
+BATCH_SIZE = 5000
+
+
+def facts_matrix():
+    """Sorted ingredient ids and their facts, unknown values as 0."""
+    rows = list(Ingredient.objects.order_by('id').values_list('id', *FIELDS))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    facts = np.array([row[1:] for row in rows],
+                     dtype=np.float64).reshape(-1, len(FIELDS))
+    return ids, np.nan_to_num(facts)
+
+
+def refresh(recipe_ids, facts=None):
+    """Recomputes and saves the totals of ``recipe_ids``."""
+    recipe_ids = np.unique(np.asarray(recipe_ids, dtype=np.int64))
+    if not len(recipe_ids):
+        return
+    ingredient_ids, facts = facts or facts_matrix()
+    amounts = np.array(
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids.tolist()
+        ).values_list('recipe_id', 'ingredient_id', 'amount'),
+        dtype=np.float64).reshape(-1, 3)
+    totals = np.zeros((len(recipe_ids), len(FIELDS)))
+    np.add.at(
+        totals,
+        np.searchsorted(recipe_ids, amounts[:, 0].astype(np.int64)),
+        amounts[:, 2:] * facts[np.searchsorted(
+            ingredient_ids, amounts[:, 1].astype(np.int64))])
+    Recipe.objects.bulk_update(
+        [Recipe(id=recipe_id, **dict(zip(FIELDS, values)))
+         for recipe_id, values in zip(recipe_ids.tolist(), totals.tolist())],
+        FIELDS)
+
+
+def backfill():
+    """Recomputes the totals of every recipe in batches."""
+    facts = facts_matrix()
+    recipes = Recipe.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        recipe_ids = list(recipes.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not recipe_ids:
+            return
+        refresh(recipe_ids, facts)
+        last_id = recipe_ids[-1]
+
+
+def parse_fact(value):
+    return float(value) if value.strip() else None
+
+
+def load_facts(path):
+    """
+    Sets ingredient facts from a CSV with a ``name`` column and any of
+    ``FIELDS``; returns how many ingredients were updated.
+    """
+    with open(path, encoding='utf-8') as source:
+        reader = csv.DictReader(source)
+        columns = [field for field in FIELDS if field in reader.fieldnames]
+        facts = {row['name']: {field: parse_fact(row[field])
+                               for field in columns}
+                 for row in reader}
+    ingredients = list(Ingredient.objects.filter(name__in=facts))
+    for ingredient in ingredients:
+        for field, value in facts[ingredient.name].items():
+            setattr(ingredient, field, value)
+    Ingredient.objects.bulk_update(ingredients, columns, batch_size=1000)
+    return len(ingredients)
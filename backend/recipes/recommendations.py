@@ -0,0 +1,141 @@
+"""
+Offline "recommended for you" recipes from favorites and shopping carts.
+
+Favorites and cart entries form a sparse user x recipe matrix. Item-item
+cosine similarity is accumulated as ``X.T @ X`` over chunks of users and
+pruned to the ``ITEM_NEIGHBOURS`` closest recipes per recipe, then every
+user's recipes are scored against it chunk by chunk. So memory depends on
+the chunk size and the number of recipes, not on the number of users.
+"""
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from scipy import sparse
+from .models import (FavoriteRecipe, Recipe, RecipeShoppingList,
+                     RecommendedRecipe)
+
+FAVORITE_WEIGHT = 1.0
+CART_WEIGHT = 0.5
+ITEM_NEIGHBOURS = 50
+USER_CHUNK_SIZE = 1000
+
+
+def user_chunks():
+    """Sorted id arrays of consecutive users, ``USER_CHUNK_SIZE`` each."""
+    users = get_user_model().objects.order_by('id')
+    last_id = 0
+    while True:
+        user_ids = np.array(
+            users.filter(id__gt=last_id).values_list(
+                'id', flat=True)[:USER_CHUNK_SIZE],
+            dtype=np.int64)
+        if not len(user_ids):
+            return
+        yield user_ids
+        last_id = int(user_ids[-1])
+
+
+def interactions(user_ids, recipe_ids):
+    """Weighted user x recipe matrix of the users in ``user_ids``."""
+    blocks = []
+    for model, weight in ((FavoriteRecipe, FAVORITE_WEIGHT),
+                          (RecipeShoppingList, CART_WEIGHT)):
+        pairs = np.array(
+            model.objects.filter(
+                user_id__gte=user_ids[0], user_id__lte=user_ids[-1]
+            ).values_list('user_id', 'recipe_id'),
+            dtype=np.int64).reshape(-1, 2)
+        known = np.isin(pairs[:, 0], user_ids)
+        known &= np.isin(pairs[:, 1], recipe_ids)
+        pairs = pairs[known]
+        blocks.append((pairs, np.full(len(pairs), weight)))
+    pairs = np.concatenate([pairs for pairs, _ in blocks])
+    matrix = sparse.csr_matrix(
+        (np.concatenate([weights for _, weights in blocks]),
+         (np.searchsorted(user_ids, pairs[:, 0]),
+          np.searchsorted(recipe_ids, pairs[:, 1]))),
+        shape=(len(user_ids), len(recipe_ids)))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def top_columns(matrix, row, count, exclude=()):
+    start, end = matrix.indptr[row], matrix.indptr[row + 1]
+    columns, values = matrix.indices[start:end], matrix.data[start:end]
+    keep = (values > 0) & ~np.isin(columns, exclude)
+    columns, values = columns[keep], values[keep]
+    best = np.argsort(-values, kind='stable')[:count]
+    return columns[best], values[best]
+
+
+def item_similarity(recipe_ids):
+    """
+    Cosine similarity of recipes by the users interacting with them, pruned
+    to ``ITEM_NEIGHBOURS`` per recipe, and the weighted interaction totals.
+    """
+    cooccurrence = sparse.csr_matrix((len(recipe_ids), len(recipe_ids)))
+    popularity = np.zeros(len(recipe_ids))
+    for user_ids in user_chunks():
+        chunk = interactions(user_ids, recipe_ids)
+        cooccurrence = cooccurrence + (chunk.T @ chunk).tocsr()
+        popularity += np.asarray(chunk.sum(axis=0)).ravel()
+    norms = np.sqrt(cooccurrence.diagonal())
+    norms[norms == 0] = 1
+    similarity = (sparse.diags(1 / norms) @ cooccurrence
+                  @ sparse.diags(1 / norms)).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    rows, columns, values = [], [], []
+    for row in range(similarity.shape[0]):
+        neighbours, scores = top_columns(similarity, row, ITEM_NEIGHBOURS)
+        rows.append(np.full(len(neighbours), row))
+        columns.append(neighbours)
+        values.append(scores)
+    pruned = sparse.csr_matrix(
+        (np.concatenate(values),
+         (np.concatenate(rows), np.concatenate(columns))),
+        shape=similarity.shape)
+    return pruned, popularity
+
+
+def store(previous, recommendations):
+    with transaction.atomic():
+        previous.delete()
+        RecommendedRecipe.objects.bulk_create(recommendations)
+
+
+def recompute():
+    """Rewrites all recommendations; returns how many users got personal."""
+    count = settings.RECOMMENDED_RECIPES_COUNT
+    recipe_ids = np.array(
+        Recipe.objects.order_by('id').values_list('id', flat=True),
+        dtype=np.int64)
+    if not len(recipe_ids):
+        return 0
+    similarity, popularity = item_similarity(recipe_ids)
+
+    popular = np.argsort(-popularity, kind='stable')[:count]
+    store(RecommendedRecipe.objects.filter(user=None), [
+        RecommendedRecipe(recipe_id=int(recipe_ids[column]),
+                          score=float(popularity[column]))
+        for column in popular if popularity[column] > 0])
+
+    personalised = 0
+    for user_ids in user_chunks():
+        chunk = interactions(user_ids, recipe_ids)
+        scores = (chunk @ similarity).tocsr()
+        recommendations = []
+        for row, user_id in enumerate(user_ids.tolist()):
+            seen = chunk.indices[chunk.indptr[row]:chunk.indptr[row + 1]]
+            columns, values = top_columns(scores, row, count, exclude=seen)
+            personalised += bool(len(columns))
+            recommendations.extend(
+                RecommendedRecipe(user_id=user_id,
+                                  recipe_id=int(recipe_ids[column]),
+                                  score=float(value))
+                for column, value in zip(columns, values))
+        store(RecommendedRecipe.objects.filter(
+            user_id__in=user_ids.tolist()), recommendations)
+    return personalised
@@ -0,0 +1,87 @@
+"""
+Process-local copy of the reference tables: tags and ingredients.
+
+There are a handful of tags and a couple of thousand ingredients, and they
+hardly ever change, so every process keeps them in memory and recipe
+payloads are hydrated from ids instead of joining the tables on every read.
+
+The copy is versioned by the ``tags`` and ``ingredients`` cache generations,
+bumped after every write is committed (``recipes/signals.py``). A process
+looks at them at most every ``CHECK_INTERVAL`` seconds and reloads when
+they moved, or right away when asked for an id it does not know yet. The
+generations must live in the shared cache for the other workers to see a
+bump, hence the REDIS_URL requirement in ``gunicorn.conf.py``.
+"""
+import threading
+import time
+
+from foodgram_backend.cache import get_generation
+from .models import Ingredient, Tag
+
+CHECK_INTERVAL = 1.0
+
+
+class TagRecord:
+    __slots__ = ('id', 'name', 'color', 'slug')
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+
+class IngredientRecord:
+    __slots__ = ('id', 'name', 'measurement_unit')
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+
+def load(model, record_class):
+    return {values[0]: record_class(*values)
+            for values in model.objects.values_list(*record_class.__slots__)}
+
+
+class Snapshot:
+    __slots__ = ('version', 'tags', 'ingredients')
+
+    def __init__(self, version):
+        self.version = version
+        self.tags = load(Tag, TagRecord)
+        self.ingredients = load(Ingredient, IngredientRecord)
+
+    def covers(self, tag_ids, ingredient_ids):
+        if not self.tags.keys() >= tag_ids:
+            return False
+        return self.ingredients.keys() >= ingredient_ids
+
+
+def current_version():
+    return get_generation('tags'), get_generation('ingredients')
+
+
+class Registry:
+    __slots__ = ('snapshot', 'check_at', 'lock')
+
+    def __init__(self):
+        self.snapshot = None
+        self.check_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, tag_ids=frozenset(), ingredient_ids=frozenset()):
+        """A snapshot that is current and knows all the given ids."""
+        snapshot = self.snapshot
+        fresh = snapshot is not None and time.monotonic() < self.check_at
+        if fresh and snapshot.covers(tag_ids, ingredient_ids):
+            return snapshot
+        with self.lock:
+            version = current_version()
+            snapshot = self.snapshot
+            stale = snapshot is None or snapshot.version != version
+            if stale or not snapshot.covers(tag_ids, ingredient_ids):
+                snapshot = self.snapshot = Snapshot(version)
+            self.check_at = time.monotonic() + CHECK_INTERVAL
+        return snapshot
+
+
+registry = Registry()
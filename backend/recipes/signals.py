@@ -0,0 +1,193 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from foodgram_backend.cache import bump_generation
+from users.models import Follow, User
+from . import changelog, ingredient_index, nutrition, units
+from .models import (ChangeLogEntry, FavoriteRecipe, Ingredient, Recipe,
+                     RecipeIngredient, RecipeShoppingList, SimilarRecipe,
+                     Tag)
+
+
+# Generations are bumped after commit: a reader that sees the new
+# generation must also see the change, or it would cache the old data
+# under the new key (and the reference registry reload too early).
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_caches(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        transaction.on_commit(lambda: bump_generation('recipes'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_caches(sender, **kwargs):
+    transaction.on_commit(lambda: bump_generation('ingredients'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_caches(sender, **kwargs):
+    transaction.on_commit(lambda: bump_generation('tags'))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_caches(sender, update_fields=None, **kwargs):
+    # Logging in only moves last_login, which no payload shows.
+    if update_fields != frozenset(('last_login',)):
+        transaction.on_commit(lambda: bump_generation('users'))
+
+
+@receiver(pre_save, sender=Recipe)
+def mark_similar_stale(sender, instance, **kwargs):
+    instance.similar_stale = True
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def mark_tagged_similar_stale(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).update(similar_stale=True)
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).update(similar_stale=True)
+
+
+@receiver(pre_delete, sender=Recipe)
+def mark_neighbours_similar_stale(sender, instance, **kwargs):
+    """Recipes listing a deleted one as similar need a replacement."""
+    Recipe.objects.filter(
+        id__in=SimilarRecipe.objects.filter(
+            similar=instance).values('recipe_id')
+    ).update(similar_stale=True)
+
+
+@receiver(pre_save, sender=Ingredient)
+def set_base_unit(sender, instance, **kwargs):
+    instance.base_unit, instance.unit_factor = units.to_base(
+        instance.measurement_unit)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def log_recipe_change(sender, instance, **kwargs):
+    changelog.record(ChangeLogEntry.RECIPE, instance.pk,
+                     deleted='created' not in kwargs)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def log_recipe_tags_change(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if not action.startswith('post_'):
+        return
+    for recipe_id in (pk_set or ()) if reverse else (instance.pk,):
+        changelog.record(ChangeLogEntry.RECIPE, recipe_id)
+
+
+USER_CHANGE_KINDS = {
+    FavoriteRecipe: ChangeLogEntry.FAVORITE,
+    RecipeShoppingList: ChangeLogEntry.CART,
+}
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=RecipeShoppingList)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=RecipeShoppingList)
+def log_user_recipe_change(sender, instance, **kwargs):
+    changelog.record(USER_CHANGE_KINDS[sender], instance.recipe_id,
+                     instance.user_id, deleted='created' not in kwargs)
+    bump_viewer_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def log_follow_change(sender, instance, **kwargs):
+    changelog.record(ChangeLogEntry.FOLLOW, instance.author_id,
+                     instance.subscriber_id, deleted='created' not in kwargs)
+    subscriber_id = instance.subscriber_id
+    transaction.on_commit(
+        lambda: bump_generation(f'follows:{subscriber_id}'))
+    bump_viewer_on_commit(subscriber_id)
+
+
+def bump_viewer_on_commit(user_id):
+    """
+    Favorites, cart and follows of a user change what the API shows them
+    (``api/conditional.py``); bumped after commit so that a validator
+    computed meanwhile never goes with the old payload.
+    """
+    transaction.on_commit(lambda: bump_generation(f'viewer:{user_id}'))
+
+
+def touch_recipes(recipe_ids):
+    # update() sends no signals: the generation is bumped here instead.
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now())
+    transaction.on_commit(lambda: bump_generation('recipes'))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_retagged_recipes(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if not action.startswith('post_'):
+        return
+    touch_recipes((pk_set or ()) if reverse else (instance.pk,))
+
+
+class PendingIngredientChanges(threading.local):
+    def __init__(self):
+        self.recipe_ids, self.ingredient_ids = set(), set()
+
+
+# Recipes and ingredients whose rows changed, refreshed together after
+# commit: a form replacing a recipe's ingredients changes them row by row.
+pending_ingredient_changes = PendingIngredientChanges()
+
+
+def refresh_changed_ingredients():
+    pending = pending_ingredient_changes
+    recipe_ids, ingredient_ids = pending.recipe_ids, pending.ingredient_ids
+    if not recipe_ids and not ingredient_ids:
+        return
+    pending.recipe_ids, pending.ingredient_ids = set(), set()
+    ingredient_index.refresh(recipe_ids, ingredient_ids)
+    nutrition.refresh(list(recipe_ids))
+
+
+def ingredients_changed(recipe_ids, ingredient_ids):
+    """
+    ``recipe_ids`` gained or lost ``ingredient_ids``: the signals below call
+    this for every row, bulk writers (which send none) call it themselves.
+    """
+    touch_recipes(recipe_ids)
+    pending_ingredient_changes.recipe_ids.update(recipe_ids)
+    pending_ingredient_changes.ingredient_ids.update(ingredient_ids)
+    # Registered on every call: a rolled back savepoint drops its callback,
+    # and the first callback to run refreshes everything pending.
+    transaction.on_commit(refresh_changed_ingredients)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def refresh_replaced_ingredient(sender, instance, **kwargs):
+    # An edited row (e.g. in the admin) may leave its recipe or ingredient.
+    if instance.pk is None:
+        return
+    old = RecipeIngredient.objects.filter(pk=instance.pk).values_list(
+        'recipe_id', 'ingredient_id').first()
+    if old is not None and old != (instance.recipe_id,
+                                   instance.ingredient_id):
+        ingredients_changed((old[0],), (old[1],))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe_of_ingredient(sender, instance, **kwargs):
+    ingredients_changed((instance.recipe_id,), (instance.ingredient_id,))
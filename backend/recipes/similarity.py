@@ -0,0 +1,146 @@
+"""
+Precomputed "similar recipes" table.
+
+Every recipe is a sparse vector over ingredients (log of the amount times
+IDF) and tags (IDF scaled by ``TAG_WEIGHT``) normalised to unit length, so
+cosine similarities of a batch of recipes against all others are a single
+sparse matrix product. Only the best ``SIMILAR_RECIPES_COUNT`` neighbours of
+each recipe are kept in ``SimilarRecipe``.
+
+Recipes whose ingredients or tags change are flagged ``similar_stale``; an
+incremental run recomputes them and the recipes whose stored neighbours they
+could displace or used to be part of.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from scipy import sparse
+from .models import Recipe, RecipeIngredient, SimilarRecipe
+
+TAG_WEIGHT = 0.5
+BATCH_SIZE = 500
+
+
+def recipe_vectors():
+    """Ids of all recipes (sorted) and their unit-length feature rows."""
+    recipe_ids = np.array(
+        Recipe.objects.order_by('id').values_list('id', flat=True),
+        dtype=np.int64)
+    ingredients = np.array(
+        RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id', 'amount'),
+        dtype=np.float64).reshape(-1, 3)
+    tags = np.array(
+        Recipe.tags.through.objects.values_list('recipe_id', 'tag_id'),
+        dtype=np.int64).reshape(-1, 2)
+    # Rows of recipes created after the id list was read are skipped.
+    ingredients = ingredients[np.isin(ingredients[:, 0], recipe_ids)]
+    tags = tags[np.isin(tags[:, 0], recipe_ids)]
+
+    ingredient_ids, ingredient_columns = np.unique(ingredients[:, 1],
+                                                   return_inverse=True)
+    tag_ids, tag_columns = np.unique(tags[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.concatenate([np.log1p(ingredients[:, 2]),
+                         np.full(len(tags), TAG_WEIGHT)]),
+         (np.searchsorted(recipe_ids,
+                          np.concatenate([ingredients[:, 0], tags[:, 0]])),
+          np.concatenate([ingredient_columns,
+                          tag_columns + len(ingredient_ids)]))),
+        shape=(len(recipe_ids), len(ingredient_ids) + len(tag_ids)),
+        dtype=np.float64)
+    matrix.sum_duplicates()
+
+    frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + len(recipe_ids)) / (1 + frequency)) + 1
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return recipe_ids, sparse.diags(1 / norms) @ matrix
+
+
+def top_similar(recipe_ids, matrix, rows, count):
+    """``(row, neighbour_row, score)`` of the best neighbours of ``rows``."""
+    scores = (matrix[rows] @ matrix.T).tocsr()
+    for position, row in enumerate(rows):
+        start, end = scores.indptr[position], scores.indptr[position + 1]
+        columns, values = scores.indices[start:end], scores.data[start:end]
+        keep = (columns != row) & (values > 0)
+        # Equal vectors can score differently in the last bits depending
+        # on summation order: rounded, they tie as they should.
+        columns, values = columns[keep], np.round(values[keep], 9)
+        # Highest score first, ties broken by the newer recipe.
+        best = np.lexsort((-recipe_ids[columns], -values))[:count]
+        yield from ((row, columns[i], values[i]) for i in best)
+
+
+def affected_rows(recipe_ids, matrix, stale_rows, count):
+    """
+    Rows whose stored neighbours may be outdated by the stale recipes: the
+    stale ones, those listing a stale recipe and those a stale recipe now
+    beats the weakest stored neighbour of.
+    """
+    affected = set(stale_rows.tolist())
+    listing = SimilarRecipe.objects.filter(
+        similar_id__in=recipe_ids[stale_rows].tolist()
+    ).values_list('recipe_id', flat=True).distinct()
+    affected.update(np.searchsorted(
+        recipe_ids, np.array(list(listing), dtype=np.int64)).tolist())
+
+    threshold = np.zeros(len(recipe_ids))
+    stored = SimilarRecipe.objects.values('recipe_id').annotate(
+        weakest=Min('score'), stored=Count('*')
+    ).filter(stored__gte=count).values_list('recipe_id', 'weakest')
+    for recipe_id, weakest in stored:
+        threshold[np.searchsorted(recipe_ids, recipe_id)] = weakest
+    for start in range(0, len(stale_rows), BATCH_SIZE):
+        scores = matrix[stale_rows[start:start + BATCH_SIZE]] @ matrix.T
+        best = scores.max(axis=0).toarray().ravel()
+        affected.update(np.flatnonzero(best > threshold).tolist())
+    return np.array(sorted(affected), dtype=np.int64)
+
+
+def store(recipe_ids, rows, neighbours):
+    with transaction.atomic():
+        SimilarRecipe.objects.filter(
+            recipe_id__in=recipe_ids[rows].tolist()).delete()
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe_id=int(recipe_ids[row]),
+                          similar_id=int(recipe_ids[neighbour]),
+                          score=float(score))
+            for row, neighbour, score in neighbours)
+
+
+def mark_stale(recipe_ids, stale):
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        Recipe.objects.filter(
+            id__in=recipe_ids[start:start + BATCH_SIZE]
+        ).update(similar_stale=stale)
+
+
+def recompute(full=False):
+    """Refreshes the similar recipes table; returns how many were updated."""
+    count = settings.SIMILAR_RECIPES_COUNT
+    stale = Recipe.objects.all()
+    if not full:
+        stale = stale.filter(similar_stale=True)
+    stale_ids = list(stale.values_list('id', flat=True))
+    if not stale_ids:
+        return 0
+    # Cleared up front: a recipe edited while this runs is flagged again
+    # and picked up by the next run.
+    mark_stale(stale_ids, False)
+    try:
+        recipe_ids, matrix = recipe_vectors()
+        stale_rows = np.flatnonzero(np.isin(recipe_ids, stale_ids))
+        rows = (stale_rows if full
+                else affected_rows(recipe_ids, matrix, stale_rows, count))
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            store(recipe_ids, batch,
+                  list(top_similar(recipe_ids, matrix, batch, count)))
+    except BaseException:
+        mark_stale(stale_ids, True)
+        raise
+    return len(rows)
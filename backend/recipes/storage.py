@@ -0,0 +1,56 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file as ``<dir>/<sha256><ext>``.
+
+    Saving content that is already stored doesn't write anything and returns
+    the existing name, so a file name never changes meaning and can be
+    cached forever. Files are shared between recipes, so nothing deletes
+    them eagerly: ``collect_media_garbage`` removes the unreferenced ones
+    once they are older than its grace period. Saving known content or
+    attaching an uploaded file ``touch``-es it to restart that period.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save.
+        return name
+
+    def _save(self, name, content):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory,
+                              f'{self.content_hash(content)}{extension}')
+        try:
+            self.touch(name)
+            return name
+        except FileNotFoundError:
+            pass
+        # Write under a unique name first and rename into place: a
+        # concurrent save of the same content then simply overwrites an
+        # identical file instead of clashing on the name.
+        partial = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        os.replace(self.path(partial), self.path(name))
+        return name
+
+    def touch(self, name):
+        """Marks ``name`` as just used; FileNotFoundError if it is gone."""
+        os.utime(self.path(name))
+
+    @staticmethod
+    def content_hash(content):
+        digest = getattr(content, 'sha256', None)
+        if digest:
+            return digest
+        hasher = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        content.seek(0)
+        return hasher.hexdigest()
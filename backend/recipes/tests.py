@@ -0,0 +1,506 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from api import feed_cache
+from foodgram_backend.cache import bump_generation, get_generation
+from users.models import Follow, User
+from . import (changelog, ingredient_index, nutrition, recommendations,
+               reference, similarity, units)
+from .models import (ChangeLogEntry, FavoriteRecipe, Ingredient, Recipe,
+                     RecipeIngredient, RecipeShoppingList, RecommendedRecipe,
+                     SimilarRecipe, Tag)
+from .storage import ContentAddressedStorage
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.storage = ContentAddressedStorage()
+
+    def age(self, name, seconds):
+        path = self.storage.path(name)
+        mtime = os.path.getmtime(path) - seconds
+        os.utime(path, (mtime, mtime))
+        return mtime
+
+    def test_same_content_same_name(self):
+        first = self.storage.save('recipes/images/a.PNG', ContentFile(b'x'))
+        second = self.storage.save('recipes/images/b.png', ContentFile(b'x'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith('.png'))
+        self.assertEqual(self.storage.listdir('recipes/images')[1],
+                         [os.path.basename(first)])
+
+    def test_saving_known_content_restarts_grace_period(self):
+        name = self.storage.save('recipes/images/a.png', ContentFile(b'x'))
+        old = self.age(name, 3 * 24 * 3600)
+        self.storage.save('recipes/images/b.png', ContentFile(b'x'))
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), old)
+
+    def test_deleted_recipe_keeps_shared_file(self):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        name = self.storage.save('recipes/images/a.png', ContentFile(b'x'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(author=author, name='Рецепт', image=name,
+                                  text='Описание', cooking_time=5).delete()
+        self.assertTrue(self.storage.exists(name))
+
+
+class GenerationTests(TestCase):
+    """Cache generations move only once the change is committed."""
+
+    def assertBumpedOnCommit(self, generation, write):
+        before = get_generation(generation)
+        with self.captureOnCommitCallbacks() as callbacks:
+            write()
+            self.assertEqual(get_generation(generation), before)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_generation(generation), before)
+
+    def test_recipe_write(self):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        self.assertBumpedOnCommit('recipes', lambda: Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/images/a.png',
+            text='Описание', cooking_time=5))
+
+    def test_follow(self):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        reader = User.objects.create(username='reader',
+                                     email='reader@example.com')
+        self.assertBumpedOnCommit(
+            f'follows:{reader.pk}',
+            lambda: Follow.objects.create(subscriber=reader, author=author))
+
+
+class RegistryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+
+    def setUp(self):
+        self.registry = reference.Registry()
+        self.now = 1000.0
+        for patch in (
+                mock.patch.object(reference.time, 'monotonic',
+                                  lambda: self.now),
+                mock.patch.object(reference, 'current_version',
+                                  wraps=reference.current_version)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_generations_are_checked_every_interval(self):
+        snapshot = self.registry.get()
+        self.assertEqual(set(snapshot.tags), {self.tag.pk})
+        dinner = Tag.objects.create(name='Ужин', color='#49B64E',
+                                    slug='dinner')
+        bump_generation('tags')
+        self.now += reference.CHECK_INTERVAL / 2
+        with self.assertNumQueries(0):
+            self.assertIs(self.registry.get(), snapshot)
+        self.assertEqual(reference.current_version.call_count, 1)
+
+        self.now += reference.CHECK_INTERVAL
+        self.assertEqual(set(self.registry.get().tags),
+                         {self.tag.pk, dinner.pk})
+        self.assertEqual(reference.current_version.call_count, 2)
+
+    def test_unchanged_generations_keep_the_snapshot(self):
+        snapshot = self.registry.get()
+        self.now += reference.CHECK_INTERVAL * 2
+        with self.assertNumQueries(0):
+            self.assertIs(self.registry.get(), snapshot)
+
+    def test_unknown_id_reloads_at_once(self):
+        snapshot = self.registry.get()
+        # Not committed yet, so no generation was bumped.
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        reloaded = self.registry.get(ingredient_ids={salt.pk})
+        self.assertIsNot(reloaded, snapshot)
+        self.assertEqual(reloaded.ingredients[salt.pk].name, 'соль')
+
+
+class IngredientIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        cls.flour, cls.milk, cls.salt = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко', 'соль'))
+        cls.recipes = []
+        for number, ingredients in enumerate((
+                [cls.flour, cls.milk],
+                [cls.flour, cls.milk, cls.salt],
+                [cls.salt])):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image='recipes/images/a.png', text='Описание',
+                cooking_time=5)
+            cls.add(recipe, ingredients)
+            cls.recipes.append(recipe)
+
+    @classmethod
+    def add(cls, recipe, ingredients):
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients)
+        ingredient_index.refresh(
+            [recipe.pk], recipe.recipeingredient_set.values_list(
+                'ingredient_id', flat=True))
+
+    def rank(self, *ingredients):
+        return ingredient_index.rank(
+            [ingredient.pk for ingredient in ingredients], 10)
+
+    def test_best_coverage_first(self):
+        first, second, third = self.recipes
+        self.assertEqual(self.rank(self.flour, self.milk),
+                         [first.pk, second.pk])
+        self.assertEqual(self.rank(self.salt), [third.pk, second.pk])
+        self.assertEqual(self.rank(self.flour, self.milk, self.salt),
+                         [second.pk, first.pk, third.pk])
+
+    def test_counts_follow_recipe_changes(self):
+        first, second, _ = self.recipes
+        self.add(first, [self.salt])
+        # Both now have two of three ingredients: the newest goes first.
+        self.assertEqual(self.rank(self.flour, self.milk),
+                         [second.pk, first.pk])
+
+    def test_row_edits_refresh_the_index(self):
+        # One row at a time, as the admin writes them.
+        first, second, third = self.recipes
+        row = first.recipeingredient_set.get(ingredient=self.milk)
+        row.ingredient = self.salt
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        self.assertEqual(self.rank(self.milk), [second.pk])
+        self.assertEqual(self.rank(self.salt),
+                         [third.pk, first.pk, second.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            third.delete()
+        self.assertEqual(self.rank(self.salt), [first.pk, second.pk])
+
+    def test_ranking_reads_only_the_index(self):
+        with self.assertNumQueries(1):
+            self.rank(self.flour, self.milk, self.salt)
+
+
+class UnitsTests(SimpleTestCase):
+
+    def test_to_base(self):
+        self.assertEqual(units.to_base('кг'), ('г', 1000))
+        self.assertEqual(units.to_base('ст. л.'), ('мл', 15))
+        # Unknown units are their own base; some can't be summed at all.
+        self.assertEqual(units.to_base('шт.'), ('шт.', 1))
+        self.assertEqual(units.to_base('по вкусу'), ('по вкусу', None))
+
+    def test_humanize(self):
+        self.assertEqual(units.humanize(1500, 'г'), ('1.5', 'кг'))
+        self.assertEqual(units.humanize(250, 'мл'), ('250', 'мл'))
+        self.assertEqual(units.humanize(2 / 3, 'шт.'), ('0.67', 'шт.'))
+        self.assertEqual(units.humanize(None, 'по вкусу'), ('', 'по вкусу'))
+
+
+class NutritionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г', kcal=3.5, protein=0.1,
+            fat=0.01, carbs=0.7, price=0.05)
+        # Unknown facts count as zero.
+        cls.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г', price=0.02)
+
+    def test_facts_matrix(self):
+        ids, facts = nutrition.facts_matrix()
+        self.assertEqual(ids.tolist(), [self.flour.pk, self.salt.pk])
+        self.assertEqual(facts.tolist(), [[3.5, 0.1, 0.01, 0.7, 0.05],
+                                          [0, 0, 0, 0, 0.02]])
+
+    def test_refresh(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Хлеб', image='recipes/images/a.png',
+            text='Описание', cooking_time=5)
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=self.flour,
+                             amount=Decimal('200')),
+            RecipeIngredient(recipe=recipe, ingredient=self.salt,
+                             amount=Decimal('2.5'))])
+        nutrition.refresh([recipe.pk])
+        recipe.refresh_from_db()
+        totals = [getattr(recipe, field) for field in nutrition.FIELDS]
+        for total, expected in zip(totals, (700, 20, 2, 140, 10.05)):
+            self.assertAlmostEqual(total, expected)
+
+    def test_row_edits_refresh_the_totals(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Хлеб', image='recipes/images/a.png',
+            text='Описание', cooking_time=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            row = RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.flour, amount=100)
+        recipe.refresh_from_db()
+        self.assertAlmostEqual(recipe.kcal, 350)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.kcal, 0)
+
+
+@override_settings(SIMILAR_RECIPES_COUNT=2)
+class SimilarityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.flour, cls.milk, cls.sugar, cls.salt = (
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit='г')
+                for name in ('мука', 'молоко', 'сахар', 'соль')))
+
+    def create(self, *ingredients):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image='recipes/images/a.png',
+            text='Описание', cooking_time=5)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+            for ingredient in ingredients)
+        return recipe
+
+    def similar(self, recipe):
+        return list(SimilarRecipe.objects.filter(recipe=recipe).order_by(
+            '-score', '-similar_id').values_list('similar_id', flat=True))
+
+    def test_best_neighbours_first(self):
+        pancakes = self.create(self.flour, self.milk, self.sugar)
+        bread = self.create(self.flour, self.milk)
+        cake = self.create(self.flour, self.milk, self.sugar)
+        brine = self.create(self.salt)
+        self.assertEqual(similarity.recompute(full=True), 4)
+        self.assertEqual(self.similar(pancakes), [cake.pk, bread.pk])
+        self.assertEqual(self.similar(bread), [cake.pk, pancakes.pk])
+        # Nothing in common: no neighbours at all.
+        self.assertEqual(self.similar(brine), [])
+
+    def test_new_recipe_displaces_weaker_neighbours(self):
+        pancakes = self.create(self.flour, self.milk, self.sugar)
+        bread = self.create(self.flour, self.milk)
+        syrup = self.create(self.sugar, self.salt)
+        similarity.recompute(full=True)
+        self.assertEqual(self.similar(pancakes), [bread.pk, syrup.pk])
+        cake = self.create(self.flour, self.milk, self.sugar)
+        similarity.recompute()
+        self.assertEqual(self.similar(pancakes), [cake.pk, bread.pk])
+
+
+class RecommendationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create(username=name,
+                                     email=f'{name}@example.com')
+                 for name in ('first', 'second', 'third', 'reader', 'new')]
+        cls.reader, cls.newcomer = users[3:]
+        cls.recipes = [
+            Recipe.objects.create(author=users[0], name=f'Рецепт {number}',
+                                  image='recipes/images/a.png',
+                                  text='Описание', cooking_time=5)
+            for number in range(4)]
+        first, second, third, fourth = cls.recipes
+        for user, favorites in zip(users, ([first, second],
+                                           [first, second, third],
+                                           [third],
+                                           [first])):
+            for recipe in favorites:
+                FavoriteRecipe.objects.create(user=user, recipe=recipe)
+        RecipeShoppingList.objects.create(user=users[2], recipe=fourth)
+
+    def recommended(self, user):
+        return list(RecommendedRecipe.objects.filter(user=user).order_by(
+            '-score').values_list('recipe_id', 'score'))
+
+    def get(self, user):
+        token = Token.objects.create(user=user)
+        response = self.client.get('/api/recipes/recommended/',
+                                   HTTP_AUTHORIZATION=f'Token {token.key}')
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_item_item_ranking(self):
+        first, second, third, fourth = self.recipes
+        self.assertEqual(recommendations.recompute(), 4)
+        # The first recipe shares two users with the second, one with the
+        # third and none with the fourth.
+        ranked = self.recommended(self.reader)
+        self.assertEqual([recipe_id for recipe_id, _ in ranked],
+                         [second.pk, third.pk])
+        self.assertAlmostEqual(ranked[0][1], 2 / 6 ** 0.5)
+        self.assertAlmostEqual(ranked[1][1], 1 / 6 ** 0.5)
+        self.assertEqual(self.recommended(None), [
+            (first.pk, 3), (second.pk, 2), (third.pk, 2), (fourth.pk, 0.5)])
+        self.assertEqual(self.get(self.reader), [second.pk, third.pk])
+
+    def test_chunks_give_the_same_result(self):
+        recommendations.recompute()
+        expected = list(RecommendedRecipe.objects.order_by(
+            'user_id', 'recipe_id').values_list('user_id', 'recipe_id'))
+        with mock.patch.object(recommendations, 'USER_CHUNK_SIZE', 2):
+            recommendations.recompute()
+        self.assertEqual(
+            list(RecommendedRecipe.objects.order_by(
+                'user_id', 'recipe_id').values_list('user_id', 'recipe_id')),
+            expected)
+
+    def test_popular_recipes_without_history(self):
+        first, second, third, fourth = self.recipes
+        recommendations.recompute()
+        self.assertEqual(self.recommended(self.newcomer), [])
+        # Equally popular: the newer recipe first.
+        self.assertEqual(self.get(self.newcomer),
+                         [first.pk, third.pk, second.pk, fourth.pk])
+
+
+class WarmCachesTests(TestCase):
+
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_caches')
+
+
+class WarmCachesCommandTests(TransactionTestCase):
+    # The command reads from its own threads: the data must be committed.
+
+    @mock.patch('recipes.management.commands.warm_caches.is_shared',
+                return_value=True)
+    def test_popular_recipes_are_served_from_the_cache(self, is_shared):
+        reader, (popular, other) = create_recipes(2)
+        FavoriteRecipe.objects.create(user=reader, recipe=popular)
+        cache.clear()
+        call_command('warm_caches', recipes=1, stdout=StringIO())
+        before = feed_cache.recipe_stats.snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/recipes/{popular.pk}/')
+        self.assertEqual(response.json()['id'], popular.pk)
+        self.assertTrue(
+            response.json()['image'].startswith('http://testserver/'))
+        self.client.get(f'/api/recipes/{other.pk}/')
+        after = feed_cache.recipe_stats.snapshot()
+        self.assertEqual((after['hit'], after['miss']),
+                         (before['hit'] + 1, before['miss'] + 1))
+
+
+def create_recipes(count):
+    author = User.objects.create(username='author',
+                                 email='author@example.com')
+    reader = User.objects.create(username='reader',
+                                 email='reader@example.com')
+    return reader, [
+        Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                              image='recipes/images/a.png',
+                              text='Описание', cooking_time=5)
+        for number in range(count)]
+
+
+def favorite_changes(changes):
+    return {target_id for (kind, target_id), deleted in changes.items()
+            if kind == ChangeLogEntry.FAVORITE and not deleted}
+
+
+class ChangeLogTests(TestCase):
+
+    def test_late_commit_is_not_skipped(self):
+        reader, (first, second) = create_recipes(2)
+        # The first transaction writes first but commits last.
+        with self.captureOnCommitCallbacks() as first_commit:
+            FavoriteRecipe.objects.create(user=reader, recipe=first)
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteRecipe.objects.create(user=reader, recipe=second)
+        changes, cursor, _ = changelog.changes_since(0, reader, 100, 0)
+        self.assertEqual(favorite_changes(changes), {second.pk})
+
+        for callback in first_commit:
+            callback()
+        changes, _, _ = changelog.changes_since(cursor, reader, 100, 0)
+        self.assertEqual(favorite_changes(changes), {first.pk})
+
+    def test_recent_entries_are_held_back(self):
+        reader, (first, second) = create_recipes(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteRecipe.objects.create(user=reader, recipe=first)
+            FavoriteRecipe.objects.create(user=reader, recipe=second)
+        entries = ChangeLogEntry.objects.filter(
+            kind=ChangeLogEntry.FAVORITE).order_by('id')
+        ChangeLogEntry.objects.filter(pk=entries[1].pk).update(
+            created=timezone.now() - timedelta(minutes=1))
+
+        # The older entry has the smaller id and is still recent: nothing
+        # after it is served, not even the settled one.
+        changes, cursor, has_more = changelog.changes_since(
+            0, reader, 100, 10)
+        self.assertEqual(favorite_changes(changes), set())
+        self.assertFalse(has_more)
+
+        ChangeLogEntry.objects.filter(pk=entries[0].pk).update(
+            created=timezone.now() - timedelta(minutes=1))
+        changes, _, _ = changelog.changes_since(cursor, reader, 100, 10)
+        self.assertEqual(favorite_changes(changes), {first.pk, second.pk})
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'needs concurrent write transactions')
+class ChangeLogConcurrencyTests(TransactionTestCase):
+
+    def test_late_commit_is_not_skipped(self):
+        reader, (first, second) = create_recipes(2)
+        written, release = threading.Event(), threading.Event()
+
+        def slow_writer():
+            try:
+                with transaction.atomic():
+                    FavoriteRecipe.objects.create(user=reader, recipe=first)
+                    written.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=slow_writer)
+        thread.start()
+        self.assertTrue(written.wait(5))
+        FavoriteRecipe.objects.create(user=reader, recipe=second)
+        changes, cursor, _ = changelog.changes_since(0, reader, 100, 0)
+        release.set()
+        thread.join()
+        later, _, _ = changelog.changes_since(cursor, reader, 100, 0)
+        self.assertEqual(favorite_changes(changes) | favorite_changes(later),
+                         {first.pk, second.pk})
@@ -0,0 +1,43 @@
+"""
+Measurement units of the ingredient catalogue (data/ingredients.csv).
+
+Every ``measurement_unit`` maps to a base unit and a factor, which are
+stored on the ingredient (``base_unit``, ``unit_factor``) so a shopping list
+can sum amounts in base units in a single GROUP BY. Units missing from the
+table are their own base unit; units that cannot be summed get no factor.
+"""
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'капля': ('мл', 0.05),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+}
+NOT_SUMMABLE = {'по вкусу'}
+# Bigger units to show a total in once it reaches their size.
+DISPLAY_UNITS = {
+    'г': (('кг', 1000),),
+    'мл': (('л', 1000),),
+}
+
+
+def to_base(measurement_unit):
+    """``(base_unit, factor)``, the factor is None for unsummable units."""
+    if measurement_unit in NOT_SUMMABLE:
+        return measurement_unit, None
+    return UNIT_CONVERSIONS.get(measurement_unit, (measurement_unit, 1))
+
+
+def humanize(amount, base_unit):
+    """Re-expresses a total in base units as ``(amount, unit)`` text."""
+    if amount is None:
+        return '', base_unit
+    unit = base_unit
+    for display_unit, size in DISPLAY_UNITS.get(base_unit, ()):
+        if amount >= size:
+            amount, unit = amount / size, display_unit
+            break
+    return f'{round(amount, 2):g}', unit
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from foodgram_backend.paginators import EstimatedCountPaginator
 
 from .models import Follow
 
@@ -9,10 +10,17 @@ User = get_user_model()
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('email', 'first_name', 'last_name')
-    list_filter = ('email', 'first_name', 'last_name')
+    search_fields = ('^email', '^username', '^first_name', '^last_name')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('subscriber', 'author', 'date_subscribed')
-    list_filter = ('subscriber', 'author', 'date_subscribed')
+    list_filter = ('date_subscribed',)
+    list_select_related = ('subscriber', 'author')
+    search_fields = ('^subscriber__username', '^author__username')
+    autocomplete_fields = ('subscriber', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
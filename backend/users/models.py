@@ -23,6 +23,7 @@ class User(AbstractUser):
         verbose_name=('Пароль'),
         max_length=PASSWORD_LEN
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Follow(models.Model):